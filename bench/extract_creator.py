@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+'''
+    Micro-benchmark of the user page extraction: the old BeautifulSoup tree with html.parser against
+    the targeted scan of lib/extract.py.
+
+    Usage: python bench/extract_creator.py [-n repeats] [saved user page ...]
+
+    Without pages a synthetic user page of about 200 kB is used.
+'''
+
+import os
+import sys
+import timeit
+import argparse
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.extract import extract_creator_data
+
+
+def old_extract(content):
+    # what Pykick.__extract_creator_data did before: a full tree of the page, then the list items
+    soup = BeautifulSoup(content.decode('utf-8'), 'html.parser')
+    list_items = soup.findAll('li', {'class', 'nav--subnav__item'})
+    return {item.text.split()[0]:item.text.split()[1] for item in list_items if len(item.text.split())>1}
+
+
+def synthetic_page():
+    filler = '<div class="grid-row"><p class="text">lorem <a href="/x">ipsum</a> &amp; dolor</p></div>\n'
+    nav = ('<ul class="nav--subnav">\n'
+           '<li class="nav--subnav__item"><a class="nav--subnav__item__link" href="/profile/x">About</a></li>\n'
+           '<li class="nav--subnav__item"><a href="/profile/x/backed">Backed\n<span class="count">\n12\n</span></a></li>\n'
+           '<li class="nav--subnav__item selected"><a href="/profile/x/created">Created <span class="count">2</span></a></li>\n'
+           '<li class="nav--subnav__item"><a href="/profile/x/comments">Comments <span class="count">7</span></a></li>\n'
+           '</ul>\n')
+    return '<html><body>\n' + filler * 800 + nav + filler * 1200 + '</body></html>'
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the user page extraction.')
+    parser.add_argument('-n', '--repeats', type=int, default=20)
+    parser.add_argument('pages', nargs='*', help='saved user pages')
+    args = parser.parse_args()
+
+    pages = [(path, open(path, 'rb').read()) for path in args.pages] or [('synthetic', synthetic_page())]
+
+    for name, content in pages:
+        assert old_extract(content) == extract_creator_data(content)
+
+        old = timeit.timeit(lambda: old_extract(content), number=args.repeats) / args.repeats
+        new = timeit.timeit(lambda: extract_creator_data(content), number=args.repeats) / args.repeats
+
+        print '%s (%i kB): %s' % (name, len(content) / 1024, extract_creator_data(content))
+        print '    BeautifulSoup:  %8.3f ms' % (old * 1000)
+        print '    targeted scan:  %8.3f ms  (%.0fx)' % (new * 1000, old / new)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,63 @@
+# -*- coding: utf-8 -*-
+'''
+    Micro-benchmark of the project page extraction: the old regex over the whole decoded page against
+    lib/extract.py on the raw bytes, read at once and in 8 kB chunks like a streamed response.
+
+    Usage: python bench/extract_project.py [-n repeats] [saved project page ...]
+
+    Without pages a synthetic project page of about 400 kB is used.
+'''
+
+import os
+import sys
+import re
+import json
+import timeit
+import argparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.extract import extract_project
+
+OLD_REGEX = re.compile(r'window.current_project = \"(.+)\"')
+CHUNK_SIZE = 8192
+
+
+def old_extract(content):
+    # what Pykick.__extract_data did before: decode the page, regex over all of it, unescape, load
+    text = content.decode('utf-8')
+    project_text = OLD_REGEX.search(text).groups()
+    return json.loads(project_text[0].replace('&quot;','"').replace('\\\\','\\'))
+
+
+def synthetic_page():
+    project = {'id' : 1, 'name' : u'A "quoted" project – with \\ backslashes',
+               'blurb' : 'x' * 2000, 'rewards' : [{'id' : i, 'description' : 'reward %s ' % i * 20} for i in range(200)]}
+    text = json.dumps(project).replace('\\', '\\\\').replace('"', '&quot;')
+    filler = '<div class="filler">%s</div>\n' % ('lorem ipsum ' * 10)
+    return (filler * 1500 + '<script>\nwindow.current_project = "%s";\n</script>\n' % text + filler * 1500)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the project page extraction.')
+    parser.add_argument('-n', '--repeats', type=int, default=50)
+    parser.add_argument('pages', nargs='*', help='saved project pages')
+    args = parser.parse_args()
+
+    pages = [(path, open(path, 'rb').read()) for path in args.pages] or [('synthetic', synthetic_page())]
+
+    for name, content in pages:
+        chunks = [content[i:i + CHUNK_SIZE] for i in range(0, len(content), CHUNK_SIZE)]
+        assert old_extract(content) == extract_project([content]) == extract_project(chunks)
+
+        old = timeit.timeit(lambda: old_extract(content), number=args.repeats) / args.repeats
+        new = timeit.timeit(lambda: extract_project([content]), number=args.repeats) / args.repeats
+        streamed = timeit.timeit(lambda: extract_project(chunks), number=args.repeats) / args.repeats
+
+        print '%s (%i kB)' % (name, len(content) / 1024)
+        print '    regex on text:  %8.3f ms' % (old * 1000)
+        print '    extract bytes:  %8.3f ms  (%.1fx)' % (new * 1000, old / new)
+        print '    extract chunks: %8.3f ms  (%.1fx)' % (streamed * 1000, old / streamed)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+'''
+    End-to-end benchmark of Pykick and Update against the local stand-in of bench/server.py, without
+    kickstarter.com and, with mongomock, without a mongodb server.
+
+    Runs get_all_projects, get_newest_projects, update_live_projects and update_creator_data on an empty
+    database one after the other and reports for each: the time, projects per second, requests, the database
+    operations and the peak memory of the process so far. The passes share one process (and the mongomock
+    database), the peak can't be reset between them: a pass only shows its own peak if it is higher than that
+    of the passes before, run a single pass to measure it on its own.
+
+    Usage: python bench/run.py [--projects N] [--latency s] [--error-rate r] [--mongo-uri uri] [--explain] [pass ...]
+
+    Without --mongo-uri mongomock is used (pip install mongomock). With a local mongod the database
+    'pykick_bench' is dropped first.
+
+    With --explain (needs --mongo-uri) the query plans of the crawler's queries are checked after the passes,
+    the benchmark fails if one of them scans the whole collection instead of using an index, or if loading the
+    state index reads the projects instead of the index alone.
+'''
+
+import os
+import sys
+import time
+import shutil
+import logging
+import resource
+import argparse
+import tempfile
+import pymongo
+from pymongo import monitoring
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from lib import update
+from lib import metrics
+from lib.pykick import Pykick
+from server import StandIn
+
+PASSES = ['get_all', 'get_newest', 'update_records', 'update_creator']
+
+DATABASE = 'pykick_bench'
+
+
+class CommandCounter(monitoring.CommandListener):
+    '''
+        Counts the commands sent to mongodb by name, only works with a real server
+    '''
+    def __init__(self):
+        self.counts = {}
+
+    def started(self, event):
+        self.counts[event.command_name] = self.counts.get(event.command_name, 0) + 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def counters():
+    # the counters of the metrics registry, summed over their labels
+    totals = {}
+    for counter in metrics.REGISTRY.snapshot()['counters']:
+        totals[counter['name']] = totals.get(counter['name'], 0) + counter['value']
+    return totals
+
+
+def histogram_count(name):
+    return sum(h['count'] for h in metrics.REGISTRY.snapshot()['histograms'] if h['name'] == name)
+
+
+def peak_memory():
+    # in MB, ru_maxrss is in kB on linux. It is the peak of the whole process up to now, not of the last pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark Pykick and Update against a local stand-in.')
+    parser.add_argument('--projects', type=int, default=3000, help='number of projects of the stand-in')
+    parser.add_argument('--latency', type=float, default=0., help='seconds every response is held back')
+    parser.add_argument('--jitter', type=float, default=0., help='up to this many seconds more, at random')
+    parser.add_argument('--error-rate', type=float, default=0., help='share of requests answered with a 503')
+    parser.add_argument('--recorded', type=str, default=None, help='directory with recorded pages for the stand-in')
+    parser.add_argument('--mongo-uri', type=str, default=None, help='local mongodb, default is mongomock')
+    parser.add_argument('--workers', type=int, default=1, help='discover pages fetched in parallel')
+    parser.add_argument('--concurrency', type=int, default=8, help='project / user pages in flight')
+    parser.add_argument('--explain', action='store_true', help='fail if a query of the crawler does a COLLSCAN or is not covered')
+    parser.add_argument('passes', nargs='*', help='the passes to run, default: %s' % ' '.join(PASSES))
+    args = parser.parse_args()
+
+    unknown = [name for name in args.passes if name not in PASSES]
+    if unknown:
+        parser.error('unknown pass %s, choose from %s' % (', '.join(unknown), ', '.join(PASSES)))
+    args.passes = args.passes or PASSES
+    if args.explain and not args.mongo_uri:
+        parser.error('--explain needs a mongodb server, mongomock has no query plans')
+
+    logdir = tempfile.mkdtemp(prefix='pykick-bench-')
+    logfile = os.path.join(logdir, 'pykick.log')
+
+    server = StandIn(projects=args.projects, latency=args.latency, jitter=args.jitter,
+                     error_rate=args.error_rate, recorded=args.recorded)
+    base_url = server.start()
+
+    commands = None
+    if args.mongo_uri:
+        commands = CommandCounter()
+        client = pymongo.MongoClient(args.mongo_uri, event_listeners=[commands])
+        client.drop_database(DATABASE)
+    else:
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit('mongomock is needed without --mongo-uri: pip install mongomock')
+        client = mongomock.MongoClient()
+
+    # retries are expected with an error rate, only errors are logged
+    kick = Pykick(loglevel=logging.ERROR, logfile=logfile, workers=args.workers, concurrency=args.concurrency,
+                  base_url=base_url)
+    kick_updater = update.Update(client=client, db=DATABASE, loglevel=logging.ERROR, logfile=logfile, kick=kick)
+
+    funcs = {'get_all' : kick_updater.get_all_projects,
+             'get_newest' : kick_updater.get_newest_projects,
+             'update_records' : kick_updater.update_live_projects,
+             'update_creator' : kick_updater.update_creator_data}
+
+    print '%s projects, latency %.3fs, error rate %.2f, %s' % (args.projects, args.latency, args.error_rate,
+                                                               args.mongo_uri or 'mongomock')
+    print '%-15s %9s %10s %9s %9s %9s %9s %10s %9s' % ('pass', 'seconds', 'projects', 'proj/s', 'requests',
+                                                      'written', 'skipped', 'db writes', 'peak MB*')
+
+    try:
+        for name in args.passes:
+            before = counters()
+            writes = histogram_count('pykick_mongo_write_seconds')
+            requests = server.requests
+            if commands:
+                commands.counts = {}
+
+            start = time.time()
+            funcs[name]()
+            seconds = time.time() - start
+
+            after = counters()
+            delta = lambda key: after.get(key, 0) - before.get(key, 0)
+            projects = delta('pykick_projects_total')
+
+            print '%-15s %9.2f %10i %9.1f %9i %9i %9i %10i %9.1f' % (
+                name, seconds, projects, projects / seconds if seconds else 0., server.requests - requests,
+                delta('pykick_projects_written_total'), delta('pykick_projects_skipped_total'),
+                histogram_count('pykick_mongo_write_seconds') - writes, peak_memory())
+            if commands:
+                print '%-15s mongodb commands: %s' % ('', ', '.join('%s %s' % item for item in sorted(commands.counts.items())))
+
+        print '* peak memory of the process since the start, not of the pass alone'
+
+        if args.explain:
+            plans = kick_updater.query_plans()
+            print
+            for name, stages in sorted(plans.items()):
+                print '%-30s %s' % (name, ' > '.join(stages))
+            if kick_updater.check_query_plans():
+                return 'a query scans the whole collection or isn\'t covered, is an index missing?'
+    finally:
+        server.stop()
+        shutil.rmtree(logdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
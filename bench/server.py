@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+'''
+    A local stand-in for kickstarter.com, for benchmarks without the real site.
+
+    It serves the discover api (/discover/advanced), project pages (/projects/<id>/<slug>) and user pages
+    (/profile/<id>) for a catalogue of synthetic projects. The discover api filters the catalogue by state,
+    category, goal / raised / pledged bucket and country like the real one, with 20 projects per page and
+    at most 200 pages, so the Partitioner works on it as well. Half of the live projects move a bit every
+    time their project page is requested.
+
+    Recorded pages can be used as templates: with a directory holding discover.json (a saved discover api
+    response), project.html (a saved project page) and / or user.html (a saved user page), the projects get
+    all the fields of the recorded ones and the pages their size and markup.
+
+    Usage: python bench/server.py [-p port] [--projects N] [--latency s] [--error-rate r] [--recorded dir]
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import threading
+import SocketServer
+import BaseHTTPServer
+from urlparse import urlparse, parse_qsl
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+from lib.partition import read_categories, STATES, WOE_IDS, GOAL_BUCKETS, RAISED_BUCKETS, PLEDGED_BUCKETS
+
+PER_PAGE = 20
+PAGE_LIMIT = 200
+
+# size of the synthetic project pages, real ones are a few hundred kB
+PAGE_SIZE = 300 * 1024
+
+# the country of every 7th project is not one of WOE_IDS, like on the real site
+OTHER_WOE_ID = 12345
+
+START = 1400000000
+
+
+class Catalogue(object):
+    '''
+        The synthetic projects of the stand-in and the discover queries over them
+    '''
+    def __init__(self, count, template = None):
+        parents, children = read_categories()
+        self.parent = {}
+        for parent in parents:
+            self.parent[parent] = parent
+            for child in children.get(parent, []):
+                self.parent[child] = parent
+        categories = sorted(self.parent)
+
+        self.template = template or {}
+        self.projects = []
+        for i in range(count):
+            rnd = random.Random(i)
+            self.projects.append({'id' : 100000 + i,
+                                  'state' : STATES[i % len(STATES)],
+                                  'category' : rnd.choice(categories),
+                                  'goal_bucket' : rnd.choice(GOAL_BUCKETS),
+                                  'raised_bucket' : rnd.choice(RAISED_BUCKETS),
+                                  'pledged_bucket' : rnd.choice(PLEDGED_BUCKETS),
+                                  'woe_id' : OTHER_WOE_ID if i % 7 == 0 else rnd.choice(WOE_IDS),
+                                  'creator' : rnd.randint(0, max(count // 3, 1)),
+                                  'goal' : rnd.randint(1, 500) * 100})
+        self.by_id = {project['id'] : project for project in self.projects}
+        self.started = int(time.time())
+        self.hits = {}
+        self.queries = {}
+        self.lock = threading.Lock()
+
+    def query(self, params):
+        '''
+            Returns the projects (the catalogue entries) of a discover query in the order of its sort
+        '''
+        key = tuple(sorted((k, v) for k, v in params.items() if k not in ('page', 'format', 'seed')))
+        with self.lock:
+            if key in self.queries:
+                return self.queries[key]
+
+        projects = self.projects
+        if 'state' in params:
+            projects = [p for p in projects if p['state'] == params['state']]
+        if 'category_id' in params:
+            category = int(params['category_id'])
+            projects = [p for p in projects if p['category'] == category or self.parent[p['category']] == category]
+        for dimension in ('goal', 'raised', 'pledged'):
+            if dimension in params:
+                projects = [p for p in projects if p[dimension + '_bucket'] == int(params[dimension])]
+        if 'woe_id' in params:
+            projects = [p for p in projects if p['woe_id'] == int(params['woe_id'])]
+
+        if params.get('sort') == 'end_date':
+            projects = sorted(projects, key=lambda p: p['id'] % 1000)
+        else:
+            projects = sorted(projects, key=lambda p: -p['id'])
+
+        with self.lock:
+            self.queries[key] = projects
+        return projects
+
+    def project(self, entry, base, moves = 0):
+        '''
+            Returns the project data of a catalogue entry as the api and the project page have it
+        '''
+        id_ = entry['id']
+        launched = START + (id_ % 100000) * 600
+        pledged = entry['goal'] * (id_ % 13) / 10 + moves * 25
+        project = dict(self.template)
+        project.update({'id' : id_, 'name' : 'Project %s' % id_, 'slug' : 'project-%s' % id_,
+                        'blurb' : 'A synthetic project for the benchmarks', 'state' : entry['state'],
+                        'goal' : '%.1f' % entry['goal'], 'pledged' : '%.1f' % pledged,
+                        'usd_pledged' : '%.1f' % pledged, 'static_usd_rate' : '1.0',
+                        'backers_count' : pledged // 40, 'created_at' : launched - 86400,
+                        'launched_at' : launched, 'deadline' : launched + 30 * 86400, 'state_changed_at' : launched,
+                        'category' : {'id' : entry['category'], 'parent_id' : self.parent[entry['category']]},
+                        'location' : {'id' : entry['woe_id']},
+                        'urls' : {'web' : {'project' : '%s/projects/%s/project-%s' % (base, id_, id_)}},
+                        'creator' : {'id' : entry['creator'], 'name' : 'Creator %s' % entry['creator'],
+                                     'urls' : {'web' : {'user' : '%s/profile/%s' % (base, entry['creator'])}}}})
+        if entry['state'] == 'live':
+            # live projects are still running
+            project['deadline'] = self.started + (id_ % 30 + 1) * 86400
+        return project
+
+    def moves(self, entry):
+        '''
+            Counts a request for the project page, returns how often the project moved since the start
+        '''
+        with self.lock:
+            self.hits[entry['id']] = self.hits.get(entry['id'], 0) + 1
+            hits = self.hits[entry['id']]
+        if entry['state'] == 'live' and entry['id'] % 2 == 0:
+            return hits
+        return 0
+
+
+class Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body, content_type = 'text/html; charset=utf-8'):
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()[:16]
+        if status == 200 and self.headers.get('If-None-Match') == etag:
+            self.send_response(304)
+            self.send_header('ETag', etag)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+
+        self.send_response(status)
+        if status == 200:
+            self.send_header('ETag', etag)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        url = urlparse(self.path)
+        params = dict(parse_qsl(url.query))
+        base = 'http://%s:%s' % (self.headers.get('Host', '').split(':')[0] or server.server_address[0],
+                                 server.server_address[1])
+
+        with server.lock:
+            server.requests += 1
+
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+        if server.error_rate and random.random() < server.error_rate:
+            return self.send(503, 'Service Unavailable', 'text/plain')
+
+        parts = url.path.strip('/').split('/')
+        if url.path == '/discover/advanced':
+            return self.discover(params, base)
+        if parts[0] == 'projects' and len(parts) >= 2 and parts[1].isdigit():
+            return self.project(int(parts[1]), base)
+        if parts[0] == 'profile' and len(parts) >= 2:
+            return self.user(parts[1])
+        self.send(404, 'Not Found', 'text/plain')
+
+    def discover(self, params, base):
+        catalogue = self.server.catalogue
+        projects = catalogue.query(params)
+        page = int(params.get('page', 1))
+
+        start = (page - 1) * PER_PAGE
+        entries = projects[start:start + PER_PAGE] if page <= PAGE_LIMIT else []
+        body = json.dumps({'projects' : [catalogue.project(entry, base) for entry in entries],
+                           'total_hits' : len(projects), 'seed' : 1, 'has_more' : start + PER_PAGE < len(projects)})
+        self.send(200, body, 'application/json; charset=utf-8')
+
+    def project(self, id_, base):
+        catalogue = self.server.catalogue
+        entry = catalogue.by_id.get(id_)
+        if entry is None:
+            return self.send(404, 'Not Found', 'text/plain')
+
+        project = catalogue.project(entry, base, catalogue.moves(entry))
+        text = json.dumps(project).replace('\\', '\\\\').replace('"', '&quot;')
+        line = 'window.current_project = "%s";' % text
+        before, after = self.server.project_page
+        self.send(200, before + line + after)
+
+    def user(self, id_):
+        self.send(200, self.server.user_page % {'id' : id_})
+
+
+class StandIn(SocketServer.ThreadingMixIn, BaseHTTPServer.HTTPServer):
+    '''
+        The stand-in server, see the module docstring.
+
+        Parameters:
+            - port: port to listen on, default is 0 (any free port)
+            - projects: number of projects in the catalogue, default is 3000
+            - latency: seconds every response is held back, default is 0
+            - jitter: up to this many seconds are added to the latency at random, default is 0
+            - error_rate: share of the requests that are answered with a 503, default is 0
+            - recorded: directory with recorded pages, see the module docstring
+            - page_size: size of the synthetic project pages in bytes
+    '''
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, port = 0, projects = 3000, latency = 0., jitter = 0., error_rate = 0., recorded = None,
+                 page_size = PAGE_SIZE):
+        BaseHTTPServer.HTTPServer.__init__(self, ('127.0.0.1', port), Handler)
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+
+        template = None
+        self.project_page = self.__synthetic_project_page(page_size)
+        self.user_page = self.__synthetic_user_page()
+        if recorded:
+            template, self.project_page, self.user_page = self.__recorded(recorded)
+
+        self.catalogue = Catalogue(projects, template)
+
+    def __synthetic_project_page(self, page_size):
+        filler = '<div class="grid-row"><p class="text">lorem <a href="/x">ipsum</a> &amp; dolor</p></div>\n'
+        head = filler * (page_size // 2 // len(filler))
+        return ('<html><head></head><body>\n' + head + '<script>\n',
+                '\n</script>\n' + head + '</body></html>\n')
+
+    def __synthetic_user_page(self):
+        filler = '<div class="grid-row"><p class="text">lorem <a href="/x">ipsum</a> &amp; dolor</p></div>\n'
+        return ('<html><body>\n' + filler * 400 +
+                '<ul class="nav--subnav">\n'
+                '<li class="nav--subnav__item"><a href="/profile/%(id)s">About</a></li>\n'
+                '<li class="nav--subnav__item"><a href="/profile/%(id)s/backed">Backed <span class="count">12</span></a></li>\n'
+                '<li class="nav--subnav__item"><a href="/profile/%(id)s/created">Created <span class="count">2</span></a></li>\n'
+                '<li class="nav--subnav__item"><a href="/profile/%(id)s/comments">Comments <span class="count">7</span></a></li>\n'
+                '</ul>\n' + filler * 600 + '</body></html>\n')
+
+    def __recorded(self, directory):
+        # the fields of a recorded project, the markup around the project data and the user page
+        template = None
+        path = os.path.join(directory, 'discover.json')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                projects = json.load(f).get('projects')
+            if projects:
+                template = projects[0]
+
+        project_page = self.project_page
+        path = os.path.join(directory, 'project.html')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                page = f.read()
+            start = page.find('window.current_project = "')
+            if start >= 0:
+                end = page.find('\n', start)
+                project_page = (page[:start], page[end:] if end >= 0 else '')
+
+        user_page = self.user_page
+        path = os.path.join(directory, 'user.html')
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                user_page = f.read().replace('%', '%%')
+
+        return template, project_page, user_page
+
+    def start(self):
+        '''
+            Serves from a background thread, returns the base url
+        '''
+        thread = threading.Thread(target=self.serve_forever, name='stand-in')
+        thread.daemon = True
+        thread.start()
+        return 'http://%s:%s' % self.server_address
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='A local stand-in for kickstarter.com.')
+    parser.add_argument('-p', '--port', type=int, default=8080)
+    parser.add_argument('--projects', type=int, default=3000, help='number of projects in the catalogue')
+    parser.add_argument('--latency', type=float, default=0., help='seconds every response is held back')
+    parser.add_argument('--jitter', type=float, default=0., help='up to this many seconds more, at random')
+    parser.add_argument('--error-rate', type=float, default=0., help='share of requests answered with a 503')
+    parser.add_argument('--recorded', type=str, default=None, help='directory with recorded pages')
+    args = parser.parse_args()
+
+    server = StandIn(port=args.port, projects=args.projects, latency=args.latency, jitter=args.jitter,
+                     error_rate=args.error_rate, recorded=args.recorded)
+    print 'serving %s projects on http://%s:%s' % ((args.projects,) + server.server_address)
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,5 +1,19 @@
 import argparse
 
+
+def shard(text):
+    '''
+        Parses a shard given as i/N into (i, N)
+    '''
+    try:
+        index, count = [int(part) for part in text.split('/')]
+    except ValueError:
+        raise argparse.ArgumentTypeError('the shard has to be given as i/N, e.g. 0/4')
+    if count < 1 or not 0 <= index < count:
+        raise argparse.ArgumentTypeError('the shard i/N needs 0 <= i < N')
+    return index, count
+
+
 class Args:
     def __init__(self):
         self.parser = argparse.ArgumentParser( formatter_class=argparse.RawTextHelpFormatter)
@@ -18,10 +32,44 @@ class Args:
         self.parser.add_argument('-l', '--logfile', type=str, 
                                     help='The path to the log file.', 
                                     default='../logs/pykick.log')
-        self.parser.add_argument('func', choices = ['get_all', 'get_newest', 'update_records', 'update_creator'], help='''get_all - try to get all projects from kickstarter, takes several hours!
+        self.parser.add_argument('-i', '--incremental', action='store_true',
+                                    help='''get_newest: stop at the first page with only known projects.
+export: only export what changed since the last export.''')
+        self.parser.add_argument('-r', '--resume', action='store_true',
+                                    help='get_all: continue the last sweep where it stopped.')
+        self.parser.add_argument('-sb', '--status-buckets', action='store_true',
+                                    help='Keep the status history in the collection <collection>_status.')
+        self.parser.add_argument('-w', '--workers', type=int, default=1,
+                                    help='Number of worker processes for get_all, update_records and update_creator.')
+        self.parser.add_argument('-pw', '--page-workers', type=int, default=1,
+                                    help='Number of discover pages fetched at once by get_all and get_newest.')
+        self.parser.add_argument('-c', '--concurrency', type=int, default=8,
+                                    help='Number of project and user pages downloaded at once by every process.')
+        self.parser.add_argument('-rl', '--rate-limit', type=float, default=5.,
+                                    help='''Requests per second to kickstarter.com of this machine, shared by its worker processes
+(default: 5, 0 for no limit).''')
+        self.parser.add_argument('-st', '--streaming', action='store_true',
+                                    help='Parse discover pages while they are downloaded (one page at a time).')
+        self.parser.add_argument('-cd', '--cache-dir', type=str, default=None,
+                                    help='Cache project, user and category pages in this directory and revalidate them.')
+        self.parser.add_argument('-s', '--shard', type=shard, default=None,
+                                    help='''This machine's share i/N of the work, when N machines share the database.
+get_all: shard 0 plans the sweep and has to be started first.''')
+        self.parser.add_argument('-mp', '--metrics-port', type=int, default=None,
+                                    help='Serve metrics in the prometheus text format on this port (workers use the next ports).')
+        self.parser.add_argument('-mh', '--metrics-host', type=str, default='127.0.0.1',
+                                    help='The address the metrics are served on, e.g. 0.0.0.0 for all interfaces.')
+        self.parser.add_argument('-mf', '--metrics-file', type=str, default=None,
+                                    help='Dump the metrics as json to this file every 30 seconds (workers add their number).')
+        self.parser.add_argument('-o', '--export-dir', type=str, default='./export',
+                                    help='export: the directory for the exported files.')
+        self.parser.add_argument('-f', '--format', type=str, choices=['csv', 'parquet'], default='csv',
+                                    help='export: gzip compressed csv or parquet (needs pyarrow).')
+        self.parser.add_argument('func', choices = ['get_all', 'get_newest', 'update_records', 'update_creator', 'export'], help='''get_all - try to get all projects from kickstarter, takes several hours!
 get_newest - get the newest live projects.
 update_records - will update  all live projects in the local database.
-update_creator - will update information about the project creators.''')
+update_creator - will update information about the project creators.
+export - export the projects and their status history to files for analysis.''')
 
     def get_args(self, args=None):
         return self.parser.parse_args(args)
\ No newline at end of file
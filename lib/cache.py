@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+
+import os
+import re
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+# seconds for which a cached page is used without asking the server, by url pattern. After that the page
+# is revalidated with a conditional request. The first matching pattern wins, other urls get 0.
+DEFAULT_TTLS = [(r'/projects/', 0),
+                (r'/profile/', 24 * 3600),
+                (r'/discover$', 24 * 3600)]
+
+# default maximum size of the cache on disk, in bytes
+DEFAULT_SIZE = 512 * 1024 * 1024
+
+# response headers that are kept with a cached page
+KEEP_HEADERS = ('Content-Type', 'ETag', 'Last-Modified')
+
+# share of max_size a full cache is brought down to, so the directory isn't scanned again on every store
+LOW_WATER = 0.9
+
+# seconds after which the directory is scanned again on the next store, to see what other processes stored
+RESCAN_INTERVAL = 60.
+
+
+class HTTPCache(object):
+    '''
+        An on-disk cache of responses, revalidated with ETag / Last-Modified.
+
+        Every page is stored as two files in the cache directory: <sha1 of url>.body with the content and
+        <sha1 of url>.json with the url, the kept headers and the time it was stored or last revalidated.
+        When the cache grows over max_size bytes, the least recently used pages are deleted.
+
+        Several processes can share a cache directory, e.g. the workers of one machine. Every process keeps its
+        own list of the pages, which only knows what it stored itself and what was there when it last looked.
+        So pages another process stored are picked up from disk when they are asked for, and the directory is
+        scanned again every rescan_interval seconds and before pages are deleted: max_size is for the whole
+        directory (it can be overshot by what the other processes stored since the last scan), and the pages
+        that were used last by any process are the ones that are kept.
+
+        Parameters:
+            - directory: the cache directory, it is created if it doesn't exist
+            - max_size: maximum size of all cached pages in bytes, default is 512 MB
+            - ttls: list of (url regex, seconds) to override DEFAULT_TTLS
+            - rescan_interval: seconds after which a store scans the directory again, default is a minute
+    '''
+    def __init__(self, directory, max_size = DEFAULT_SIZE, ttls = None, rescan_interval = RESCAN_INTERVAL):
+        self.directory = directory
+        self.max_size = max_size
+        self.rescan_interval = rescan_interval
+        self.ttls = [(re.compile(pattern), ttl) for pattern, ttl in (ttls if ttls is not None else DEFAULT_TTLS)]
+        self.lock = threading.Lock()
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+        # key -> size of the body, least recently used first
+        self.entries = OrderedDict()
+        self.size = 0
+        self.__load()
+
+    def __load(self):
+        # pick up what is on disk, also the pages of other processes. The oldest files are the first to go,
+        # every use of a page touches its file
+        found = []
+        for name in os.listdir(self.directory):
+            if name.endswith('.body'):
+                path = os.path.join(self.directory, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    # deleted by another process in the meantime
+                    continue
+                found.append((stat.st_mtime, name[:-len('.body')], stat.st_size))
+
+        self.entries = OrderedDict()
+        self.size = 0
+        self.scanned = time.time()
+        for _, key, size in sorted(found):
+            self.entries[key] = size
+            self.size += size
+
+    def __key(self, url):
+        if isinstance(url, unicode):
+            url = url.encode('utf-8')
+        return hashlib.sha1(url).hexdigest()
+
+    def __path(self, key, extension):
+        return os.path.join(self.directory, key + extension)
+
+    def __write(self, path, data):
+        # write to a temporary file first, so nobody ever reads half a file
+        fd, tmp = tempfile.mkstemp(dir=self.directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.rename(tmp, path)
+
+    def __remove(self, key):
+        for extension in ('.body', '.json'):
+            try:
+                os.remove(self.__path(key, extension))
+            except OSError:
+                pass
+
+    def ttl(self, url):
+        '''
+            Returns the number of seconds a cached page of this url is used without revalidating it
+        '''
+        for pattern, ttl in self.ttls:
+            if pattern.search(url):
+                return ttl
+        return 0
+
+    def get(self, url):
+        '''
+            Returns the cache entry (a dictionary) of the url, or None
+        '''
+        key = self.__key(url)
+        with self.lock:
+            # mark it as recently used, also on disk for the next start and the other processes
+            try:
+                os.utime(self.__path(key, '.body'), None)
+            except OSError:
+                # not cached, or deleted by another process
+                self.size -= self.entries.pop(key, 0)
+                return None
+            if key not in self.entries:
+                # stored by another process
+                try:
+                    self.entries[key] = os.path.getsize(self.__path(key, '.body'))
+                except OSError:
+                    return None
+                self.size += self.entries[key]
+            else:
+                self.entries[key] = self.entries.pop(key)
+
+        try:
+            with open(self.__path(key, '.json'), 'rb') as f:
+                entry = json.load(f)
+        except (IOError, ValueError):
+            return None
+
+        if entry['url'] != url:
+            return None
+        entry['key'] = key
+        return entry
+
+    def is_fresh(self, entry):
+        '''
+            True if the entry can be used without asking the server
+        '''
+        return time.time() - entry['stored'] < self.ttl(entry['url'])
+
+    def validators(self, entry):
+        '''
+            Returns the headers for a conditional request for the entry
+        '''
+        headers = {}
+        if entry['headers'].get('ETag'):
+            headers['If-None-Match'] = entry['headers']['ETag']
+        if entry['headers'].get('Last-Modified'):
+            headers['If-Modified-Since'] = entry['headers']['Last-Modified']
+        return headers
+
+    def response(self, entry):
+        '''
+            Returns the cached page of the entry as a requests response, or None if the body is gone
+        '''
+        try:
+            with open(self.__path(entry['key'], '.body'), 'rb') as f:
+                content = f.read()
+        except IOError:
+            return None
+
+        r = requests.models.Response()
+        r.status_code = 200
+        r.url = entry['url']
+        r.headers = CaseInsensitiveDict(entry['headers'])
+        r.encoding = requests.utils.get_encoding_from_headers(r.headers)
+        r._content = content
+        return r
+
+    def refresh(self, entry):
+        '''
+            The server said the page didn't change (304), it counts as freshly stored now
+        '''
+        entry = dict(entry, stored=time.time())
+        key = entry.pop('key')
+        self.__write(self.__path(key, '.json'), json.dumps(entry))
+
+    def store(self, url, r):
+        '''
+            Stores a 200 response, if it can be revalidated or has a ttl
+        '''
+        headers = {name : r.headers[name] for name in KEEP_HEADERS if name in r.headers}
+        if not (headers.get('ETag') or headers.get('Last-Modified') or self.ttl(url)):
+            return
+
+        content = r.content
+        if len(content) > self.max_size:
+            return
+
+        key = self.__key(url)
+        self.__write(self.__path(key, '.body'), content)
+        self.__write(self.__path(key, '.json'), json.dumps({'url' : url, 'headers' : headers, 'stored' : time.time()}))
+
+        with self.lock:
+            self.size += len(content) - self.entries.pop(key, 0)
+            self.entries[key] = len(content)
+
+            # throw out the least recently used pages of all processes until we are well below max_size again
+            evicted = []
+            if self.size > self.max_size or time.time() - self.scanned >= self.rescan_interval:
+                self.__load()
+            if self.size > self.max_size:
+                while self.size > self.max_size * LOW_WATER and self.entries:
+                    old_key, old_size = self.entries.popitem(last=False)
+                    self.size -= old_size
+                    evicted.append(old_key)
+
+        for old_key in evicted:
+            self.__remove(old_key)
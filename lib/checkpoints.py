@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+
+import json
+import datetime
+from pymongo import UpdateOne
+
+
+class Checkpoints(object):
+    '''
+        Keeps track of the discover pages that were crawled completely, so a sweep can be resumed.
+
+        Every slice (the query options without 'page' and 'format') gets one document in the given
+        mongodb collection, with the last finished page and whether the whole slice is done:
+
+            {'_id' : key, 'options' : {...}, 'page' : 12, 'done' : False, 'updated' : datetime}
+
+        Progress is collected with Checkpoints.page_done / slice_done and only written with
+        Checkpoints.flush, which has to be called after the projects of these pages are in the database.
+    '''
+    def __init__(self, collection):
+        self.collection = collection
+        self.pending = {}
+
+    def key(self, options):
+        '''
+            Returns the key of the slice the options belong to
+        '''
+        slice_options = {k : v for k, v in options.items() if k not in ('page', 'format')}
+        return json.dumps(slice_options, sort_keys=True)
+
+    def get(self, options):
+        '''
+            Returns the checkpoint of the slice, or None if nothing of it was crawled yet
+        '''
+        return self.collection.find_one({'_id' : self.key(options)})
+
+    def page_done(self, options, page):
+        '''
+            Marks all pages of the slice up to page as crawled
+        '''
+        self.__set(options, {'page' : page})
+
+    def slice_done(self, options):
+        '''
+            Marks the whole slice as crawled
+        '''
+        self.__set(options, {'done' : True})
+
+    def __set(self, options, fields):
+        key = self.key(options)
+        update = self.pending.setdefault(key, {'options' : {k : v for k, v in options.items() if k != 'page'}})
+        update.update(fields)
+
+    def flush(self):
+        '''
+            Writes the collected progress to the database
+        '''
+        if not self.pending:
+            return
+
+        pending, self.pending = self.pending, {}
+        now = datetime.datetime.utcnow()
+        self.collection.bulk_write([UpdateOne({'_id' : key}, {'$set' : dict(fields, updated=now)}, upsert=True)
+                                    for key, fields in pending.items()])
+
+    def discard(self):
+        '''
+            Drops the collected progress without writing it, e.g. when the projects of these pages couldn't be written
+        '''
+        self.pending = {}
+
+    def clear(self):
+        '''
+            Forgets all progress, the next sweep starts from scratch
+        '''
+        self.pending = {}
+        self.collection.delete_many({})
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import threading
+import time
+import Queue
+import logging
+from urlparse import urlparse
+from multiprocessing.pool import ThreadPool
+
+
+class HostRateLimiter(object):
+    '''
+        Spaces out requests to the same host, so that no host gets more than `rate` requests per second.
+        Requests to different hosts don't wait for each other. A rate of None or 0 means no limit.
+    '''
+    def __init__(self, rate = None):
+        self.interval = 1. / rate if rate else 0.
+        self.lock = threading.Lock()
+        self.next_slot = {}
+
+    def wait(self, url):
+        '''
+            Blocks until the next request to the host of url may be sent
+        '''
+        host = urlparse(url).netloc
+
+        # reserve the next free slot for this host, then sleep outside of the lock
+        with self.lock:
+            now = time.time()
+            slot = max(now, self.next_slot.get(host, now))
+            self.next_slot[host] = slot + self.interval
+
+        if slot > now:
+            time.sleep(slot - now)
+
+    def pause(self, url, seconds):
+        '''
+            Holds back all requests to the host of url for the given number of seconds, e.g. after a 429 response
+        '''
+        host = urlparse(url).netloc
+
+        with self.lock:
+            self.next_slot[host] = max(self.next_slot.get(host, 0), time.time() + seconds)
+
+
+class Crawler(object):
+    '''
+        Runs a blocking function over many items with a bounded number of calls in flight.
+
+        Crawler.crawl returns an iterator of (item, result) tuples in the order the calls finish, so the
+        results can be handled while the other requests are still running.
+
+        Parameters:
+            - concurrency: maximum number of calls running at the same time, default is 8
+    '''
+    def __init__(self, concurrency = 8):
+        self.logger = logging.getLogger("pykick.Crawler")
+        self.concurrency = concurrency
+
+    def __call(self, func, item):
+        # never let an exception escape, the result would never be put on the queue
+        try:
+            return item, func(item)
+        except Exception as e:
+            self.logger.critical("Failed to crawl %s: %s", item, e)
+            return item, None
+
+    def crawl(self, func, items):
+        '''
+            Calls func(item) for every item and yields (item, result) as soon as a call is finished.
+
+            Items are only taken from the iterator when a slot is free, so a database cursor can be passed
+            in directly.
+        '''
+        pool = ThreadPool(self.concurrency)
+        done = Queue.Queue()
+        in_flight = 0
+
+        try:
+            for item in items:
+                pool.apply_async(self.__call, (func, item), callback=done.put)
+                in_flight += 1
+
+                # all slots are taken, wait for one call to finish before starting the next
+                if in_flight >= self.concurrency:
+                    yield done.get()
+                    in_flight -= 1
+
+            # wait for the calls that are still running
+            while in_flight:
+                yield done.get()
+                in_flight -= 1
+        finally:
+            pool.terminate()
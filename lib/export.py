@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import gzip
+import json
+import datetime
+import logging
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+# the columns of the project files: what Update normalizes, the ids to join on and our own timestamps
+PROJECT_COLUMNS = ['id', 'slug', 'name', 'state', 'state_changed', 'goal', 'pledged', 'usd_pledged', 'static_usd_rate',
+                   'backers_count', 'created_at', 'launched_at', 'deadline', 'state_changed_at', 'updated',
+                   'category.id', 'category.parent_id', 'creator.id', 'location.country']
+
+# the columns of the status files, one row per status sample
+STATUS_COLUMNS = ['id', 'time', 'goal', 'pledged', 'usd_pledged', 'backers_count', 'state']
+
+# default number of rows in one part file
+PART_SIZE = 100000
+
+FORMATS = ['csv', 'parquet']
+
+# the file in the export directory that remembers how far the last export got
+STATE_FILE = 'export.json'
+
+# seconds a project can be in the database with an older 'updated' time than projects written before it:
+# 'updated' is set when a project is queued, the write can follow up to a flush interval later
+LAG = 3600
+
+
+def _value(document, column):
+    # the value of a dotted column in a document, None if it is missing
+    for key in column.split('.'):
+        if not isinstance(document, dict):
+            return None
+        document = document.get(key)
+    return document
+
+
+class PartWriter(object):
+    '''
+        Writes rows to numbered part files of at most part_size rows in directory, as gzip compressed csv
+        or as parquet. Only one part is held in memory (parquet) or none at all (csv).
+    '''
+    def __init__(self, directory, prefix, columns, format = 'csv', part_size = PART_SIZE):
+        if format not in FORMATS:
+            raise ValueError('unknown export format %s, choose from %s' % (format, ', '.join(FORMATS)))
+        if format == 'parquet' and pyarrow is None:
+            raise ImportError('exporting to parquet needs pyarrow: pip install pyarrow')
+
+        self.directory = directory
+        self.prefix = prefix
+        self.columns = columns
+        self.format = format
+        self.part_size = part_size
+        self.parts = 0
+        self.rows = 0
+        self.part_rows = 0
+        self.file = None
+        self.writer = None
+        self.buffer = None
+
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+
+    def __path(self):
+        extension = 'csv.gz' if self.format == 'csv' else 'parquet'
+        return os.path.join(self.directory, '%s-%05i.%s' % (self.prefix, self.parts, extension))
+
+    def __open(self):
+        if self.format == 'csv':
+            self.file = gzip.open(self.__path(), 'wb')
+            self.writer = csv.writer(self.file)
+            self.writer.writerow(self.columns)
+        else:
+            self.buffer = {column : [] for column in self.columns}
+        self.part_rows = 0
+
+    def __encode(self, value):
+        # csv in python 2 wants byte strings
+        if value is None:
+            return ''
+        if isinstance(value, datetime.datetime):
+            return value.isoformat()
+        if isinstance(value, unicode):
+            return value.encode('utf-8')
+        return value
+
+    def write(self, row):
+        '''
+            Writes a row, a list of values in the order of the columns
+        '''
+        if self.file is None and self.buffer is None:
+            self.__open()
+
+        if self.format == 'csv':
+            self.writer.writerow([self.__encode(value) for value in row])
+        else:
+            for column, value in zip(self.columns, row):
+                self.buffer[column].append(value)
+
+        self.part_rows += 1
+        self.rows += 1
+        if self.part_rows >= self.part_size:
+            self.close()
+
+    def close(self):
+        '''
+            Finishes the current part file
+        '''
+        if self.format == 'csv' and self.file is not None:
+            self.file.close()
+            self.file = None
+            self.parts += 1
+        elif self.buffer is not None:
+            table = pyarrow.Table.from_arrays([pyarrow.array(self.buffer[column]) for column in self.columns],
+                                              names=self.columns)
+            pyarrow.parquet.write_table(table, self.__path(), compression='snappy')
+            self.buffer = None
+            self.parts += 1
+
+
+class Exporter(object):
+    '''
+        Exports the projects collection and the status history to part files for analysis, streaming the
+        collection with a projection so memory doesn't grow with it.
+
+        The projects go to <directory>/projects, the status samples (one row per sample, from the 'status'
+        arrays or from the status collection of timeseries.StatusSeries) to <directory>/status. Every
+        export writes new part files named after its start time.
+
+        With incremental = True only the projects that were updated since the last export are exported, and
+        only their newer status samples. How far the last export got is kept in <directory>/export.json: the
+        latest 'updated' time it saw, but at most lag seconds before it started, since projects with an earlier
+        'updated' time may still have been waiting to be written. So the rows of the last lag seconds are
+        exported again by the next export, keep the latest row of every project (by 'updated') when reading them.
+
+        Parameters:
+            - collection: the projects collection
+            - directory: where the part files go
+            - status_collection: the bucketed status collection, if the status history is kept there
+            - format: 'csv' (gzip compressed) or 'parquet' (needs pyarrow), default is 'csv'
+            - part_size: rows per part file, default is 100000
+            - batch_size: documents read from the database at once, default is 1000
+            - lag: the longest time in seconds between queueing and writing a project, default is an hour
+    '''
+    def __init__(self, collection, directory, status_collection = None, format = 'csv', part_size = PART_SIZE,
+                 batch_size = 1000, lag = LAG):
+        self.logger = logging.getLogger("pykick.export")
+        self.collection = collection
+        self.directory = directory
+        self.status_collection = status_collection
+        self.format = format
+        self.part_size = part_size
+        self.batch_size = batch_size
+        self.lag = lag
+
+    def __state_path(self):
+        return os.path.join(self.directory, STATE_FILE)
+
+    def last_export(self):
+        '''
+            Returns the 'updated' time up to which the last export got, or None
+        '''
+        try:
+            with open(self.__state_path(), 'r') as f:
+                state = json.load(f)
+        except (IOError, ValueError):
+            return None
+        return datetime.datetime.strptime(state['updated'], '%Y-%m-%dT%H:%M:%S.%f')
+
+    def __save_state(self, updated):
+        tmp = self.__state_path() + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump({'updated' : updated.strftime('%Y-%m-%dT%H:%M:%S.%f')}, f)
+        os.rename(tmp, self.__state_path())
+
+    def export(self, incremental = False):
+        '''
+            Exports the projects and their status history, returns the number of (project, status) rows
+        '''
+        since = self.last_export() if incremental else None
+        start = datetime.datetime.utcnow()
+        prefix = 'part-%s' % start.strftime('%Y%m%dT%H%M%S%f')
+
+        projects = PartWriter(os.path.join(self.directory, 'projects'), prefix, PROJECT_COLUMNS,
+                              self.format, self.part_size)
+        status = PartWriter(os.path.join(self.directory, 'status'), prefix, STATUS_COLUMNS,
+                            self.format, self.part_size)
+
+        query = {'updated' : {'$gt' : since}} if since else {}
+        fields = {column : 1 for column in PROJECT_COLUMNS}
+        fields['_id'] = 0
+        if self.status_collection is None:
+            fields['status'] = 1
+
+        last_updated = since
+        cursor = self.collection.find(query, fields).sort('updated', 1).batch_size(self.batch_size)
+        try:
+            for project in cursor:
+                projects.write([_value(project, column) for column in PROJECT_COLUMNS])
+
+                for sample in project.get('status', ()):
+                    if since is None or sample['time'] > since:
+                        status.write([project['id']] + [sample.get(column) for column in STATUS_COLUMNS[1:]])
+
+                if project.get('updated') and (last_updated is None or project['updated'] > last_updated):
+                    last_updated = project['updated']
+
+            if self.status_collection is not None:
+                self.__export_buckets(status, since)
+        finally:
+            cursor.close()
+            projects.close()
+            status.close()
+
+        # only remember how far we got when everything was written, and not closer to now than lag: a project
+        # queued before that may have been written after the cursor passed its 'updated' time
+        if last_updated:
+            watermark = min(last_updated, start - datetime.timedelta(seconds=self.lag))
+            self.__save_state(max(watermark, since) if since else watermark)
+
+        self.logger.info('Exported %s projects and %s status samples to %s' % (projects.rows, status.rows, self.directory))
+        return projects.rows, status.rows
+
+    def __export_buckets(self, status, since):
+        # the samples of the status collection, bucket by bucket
+        query = {'last' : {'$gt' : since}} if since else {}
+        buckets = self.status_collection.find(query, {'_id' : 0, 'project' : 1, 'samples' : 1}).batch_size(self.batch_size)
+        try:
+            for bucket in buckets:
+                for sample in bucket['samples']:
+                    if since is None or sample['time'] > since:
+                        status.write([bucket['project']] + [sample.get(column) for column in STATUS_COLUMNS[1:]])
+        finally:
+            buckets.close()
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+
+import json
+import re
+from HTMLParser import HTMLParser
+
+# the project data is a html escaped json string in a javascript assignment on the project page
+PROJECT_MARKER = 'window.current_project = "'
+
+# the characters that matter to JSONArrayStream, inside and outside of strings
+STRING_REGEX = re.compile(r'["\\]')
+STRUCTURE_REGEX = re.compile(r'["{}\[\]]')
+
+# the counts on a user page are list items with this class in the sub navigation
+CREATOR_CLASS = 'nav--subnav__item'
+CREATOR_ITEM_REGEX = re.compile(r'<li\s[^>]*class=["\'][^"\']*(?<![\w-])%s(?![\w-])[^>]*>(.*?)</li>' % CREATOR_CLASS,
+                                re.S)
+TAG_REGEX = re.compile(r'<[^>]*>')
+HTML_PARSER = HTMLParser()
+
+
+def find_project_text(chunks):
+    '''
+        Finds the escaped json text of window.current_project in a project page.
+
+        chunks is an iterable of byte strings, e.g. [r.content] or r.iter_content(8192) of a streamed response.
+        Only the line with the project is kept, reading stops at the end of that line.
+
+        Returns the text between the quotes, or None if there is no project on the page.
+    '''
+    tail = ''
+    parts = None
+
+    for chunk in chunks:
+        if parts is None:
+            # look for the marker, it can be split between two chunks
+            chunk = tail + chunk
+            start = chunk.find(PROJECT_MARKER)
+            if start < 0:
+                tail = chunk[-len(PROJECT_MARKER):]
+                continue
+            chunk = chunk[start + len(PROJECT_MARKER):]
+            parts = []
+
+        end = chunk.find('\n')
+        if end >= 0:
+            parts.append(chunk[:end])
+            break
+        parts.append(chunk)
+
+    if parts is None:
+        return None
+
+    # the json ends at the last quote on the line
+    line = ''.join(parts)
+    end = line.rfind('"')
+    if end <= 0:
+        return None
+    return line[:end]
+
+
+def unescape_project_text(text):
+    '''
+        Turns the escaped text from find_project_text into plain json: &quot; are quotes, backslashes are doubled
+    '''
+    # str.replace runs in C, two passes over the text are cheaper than one pass of a regex with a callback
+    text = text.replace('&quot;', '"')
+    if '\\\\' in text:
+        text = text.replace('\\\\', '\\')
+    return text
+
+
+def extract_project(chunks):
+    '''
+        Returns the project data of a project page as a dictionary, or None if there is no project on the page.
+        Raises a ValueError if the project data is not valid json.
+
+        chunks is an iterable of byte strings, see find_project_text.
+    '''
+    text = find_project_text(chunks)
+    if text is None:
+        return None
+    return json.loads(unescape_project_text(text))
+
+
+class JSONArrayStream(object):
+    '''
+        Incremental parser for a json object with one big array of objects, like the discover pages:
+        {"projects" : [{...}, {...}, ...], "total_hits" : 123, ...}
+
+        JSONArrayStream.feed takes the next chunk of bytes and returns the items of the array that were
+        completed by it, loaded with json.loads. Only the item that is currently parsed is kept in memory.
+        Everything outside of the array is kept as well, JSONArrayStream.close loads it once the whole
+        document was fed, with the array left empty.
+    '''
+    def __init__(self, key):
+        self.key = key
+        self.buf = ''
+        self.pos = 0
+        self.depth = 0
+        self.in_string = False
+        self.string_start = 0
+        self.last_string = None
+        self.in_array = False
+        self.item_start = 0
+        self.rest = []
+
+    def feed(self, chunk):
+        '''
+            Parses the next chunk and returns a list of the array items that were completed in it
+        '''
+        items = []
+        buf = self.buf + chunk
+        pos = self.pos
+
+        while True:
+            if self.in_string:
+                # skip to the end of the string, jumping over escaped characters
+                m = STRING_REGEX.search(buf, pos)
+                if m is None:
+                    pos = len(buf)
+                    break
+                if m.group() == '\\':
+                    if m.end() == len(buf):
+                        # the escaped character is in the next chunk
+                        pos = m.start()
+                        break
+                    pos = m.end() + 1
+                    continue
+                self.in_string = False
+                pos = m.end()
+                # remember the keys of the outer object, to find the array
+                if self.depth == 1:
+                    self.last_string = buf[self.string_start:m.start()]
+                continue
+
+            m = STRUCTURE_REGEX.search(buf, pos)
+            if m is None:
+                pos = len(buf)
+                break
+            c = m.group()
+            pos = m.end()
+
+            if c == '"':
+                self.in_string = True
+                self.string_start = pos
+
+            elif c in '{[':
+                self.depth += 1
+                if self.depth == 2 and c == '[' and self.last_string == self.key:
+                    # the array starts, keep what came before it
+                    self.in_array = True
+                    self.rest.append(buf[:pos])
+                    buf = buf[pos:]
+                    pos = 0
+                elif self.in_array and self.depth == 3:
+                    self.item_start = m.start()
+
+            else:
+                self.depth -= 1
+                if self.in_array and self.depth == 2:
+                    # an item is complete, load it and forget its text
+                    items.append(json.loads(buf[self.item_start:pos]))
+                    buf = buf[pos:]
+                    pos = 0
+                elif self.in_array and self.depth == 1:
+                    # the array is closed, the rest of the document is kept from here on
+                    self.in_array = False
+                    self.last_string = None
+                    buf = buf[m.start():]
+                    pos = 1
+
+        self.buf = buf
+        self.pos = pos
+        return items
+
+    def close(self):
+        '''
+            Returns everything outside of the array as a dictionary, the array itself is empty
+        '''
+        return json.loads(''.join(self.rest) + self.buf)
+
+
+def extract_creator_data(content):
+    '''
+        Returns the counts in the sub navigation of a user page as a dictionary, e.g.
+        {'Backed' : '12', 'Created' : '2', 'Comments' : '7'}
+
+        content is the raw page. Only the list items with the class nav--subnav__item are looked at, the rest
+        of the page is never parsed.
+    '''
+    creator_data = {}
+
+    # the items are all in one list, start at the first one and stop at the end of the list
+    start = content.find(CREATOR_CLASS)
+    if start < 0:
+        return creator_data
+    start = content.rfind('<li', 0, start)
+    end = content.find('</ul>', start)
+    if end < 0:
+        end = len(content)
+
+    for item in CREATOR_ITEM_REGEX.finditer(content, start, end):
+        # the text of the item, without tags
+        text = HTML_PARSER.unescape(TAG_REGEX.sub('', item.group(1)).decode('utf-8', 'replace')).split()
+        if len(text) > 1:
+            creator_data[text[0]] = text[1]
+
+    return creator_data
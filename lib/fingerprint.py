@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+
+import json
+import zlib
+
+# fields that are ours and not part of the scraped project, they don't count as a change
+IGNORED_FIELDS = ('_id', 'updated', 'next_refresh', 'status', 'fingerprint', 'fingerprints')
+
+# a status sample is only taken if one of these fields changed
+SAMPLE_FIELDS = ('pledged', 'backers_count', 'state')
+
+
+def field_fingerprint(value):
+    '''
+        Returns a 32 bit hash of a field value, dates and other values json doesn't know are hashed as strings
+    '''
+    return zlib.crc32(json.dumps(value, sort_keys=True, default=str)) & 0xffffffff
+
+
+def field_fingerprints(project):
+    '''
+        Returns a dictionary field -> hash of the value, for all top level fields of a project that count
+    '''
+    return {field : field_fingerprint(value) for field, value in project.items() if field not in IGNORED_FIELDS}
+
+
+def fingerprint(fingerprints):
+    '''
+        Returns one 32 bit hash of the field hashes of a project, it changes whenever one of them does
+    '''
+    return zlib.crc32(json.dumps(sorted(fingerprints.items()))) & 0xffffffff
+
+
+def changed_fields(fingerprints, stored):
+    '''
+        Returns the fields whose hash is not the stored one, stored is a dictionary like fingerprints or None
+    '''
+    stored = stored or {}
+    return [field for field, value in fingerprints.items() if stored.get(field) != value]
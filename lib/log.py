@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+
+import os
+import logging
+import logging.handlers
+
+FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# the handlers of the 'pykick' logger, the console under None and the log files by their path
+_handlers = {}
+
+
+def configure(loglevel = logging.INFO, logfile = None):
+    '''
+        Sends the messages of all 'pykick.*' loggers to the console and, if given, to logfile (one file per
+        day, kept for a week). Can be called any number of times, e.g. by every Pykick and Update: every
+        handler is only added once, a second call only changes the level. Nothing happens on import, the
+        directory of logfile is created here and the file only once there is something to write.
+    '''
+    logger = logging.getLogger('pykick')
+    formatter = logging.Formatter(FORMAT)
+
+    paths = [None]
+    if logfile:
+        paths.append(os.path.abspath(logfile))
+
+    for path in paths:
+        if path not in _handlers:
+            if path is None:
+                handler = logging.StreamHandler()
+            else:
+                if not os.path.exists(os.path.dirname(path)):
+                    os.makedirs(os.path.dirname(path))
+                handler = logging.handlers.TimedRotatingFileHandler(path, when='D', interval=1, backupCount=7,
+                                                                    delay=True)
+            handler.setFormatter(formatter)
+            logger.addHandler(handler)
+            _handlers[path] = handler
+        _handlers[path].setLevel(loglevel)
+
+    # the level of the messages is up to the loggers, the handlers filter them
+    if logger.level == logging.NOTSET or logger.level > loglevel:
+        logger.setLevel(loglevel)
@@ -0,0 +1,240 @@
+# -*- coding: utf-8 -*-
+
+import os
+import json
+import time
+import threading
+import logging
+from bisect import bisect_left
+from contextlib import contextmanager
+import BaseHTTPServer
+
+# upper bounds of the histogram buckets in seconds, the last bucket (+Inf) takes the rest
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1., 2.5, 5., 10., 30.)
+
+# seconds between two dumps of the metrics to a json file
+DUMP_INTERVAL = 30.
+
+# the address the metrics are served on, only reachable from this machine unless told otherwise
+HOST = '127.0.0.1'
+
+# help texts of the metrics, shown by the prometheus endpoint
+HELP = {
+    'pykick_http_requests_total' : 'HTTP responses by status code, "error" for connection errors and timeouts',
+    'pykick_http_retries_total' : 'HTTP requests that were retried',
+    'pykick_http_request_seconds' : 'Time until the response headers arrived',
+    'pykick_cache_total' : 'Page cache lookups by result: fresh, revalidated or miss',
+    'pykick_parse_seconds' : 'Time to extract the data of a page, by kind of page',
+    'pykick_projects_total' : 'Projects handed to the database',
+    'pykick_projects_written_total' : 'Projects written to the database',
+    'pykick_projects_skipped_total' : 'Projects that did not change and were not written',
+    'pykick_status_samples_total' : 'Status samples stored',
+    'pykick_mongo_write_seconds' : 'Time of a bulk write, by collection',
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def _format_labels(labels, extra = ()):
+    labels = list(labels) + list(extra)
+    if not labels:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (label, str(value).replace('"', '\\"')) for label, value in labels)
+
+
+class Registry(object):
+    '''
+        Counters and latency histograms of one process, safe to use from many threads.
+
+        Every metric is a name and optional labels, e.g. inc('pykick_http_requests_total', status=200).
+        Histograms count the observations in the buckets of BUCKETS and keep their sum.
+    '''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.started = time.time()
+        self.counters = {}
+        self.histograms = {}
+
+    def inc(self, name, value = 1, **labels):
+        '''
+            Adds value to a counter
+        '''
+        key = _key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        '''
+            Adds an observation to a histogram
+        '''
+        key = _key(name, labels)
+        i = bisect_left(BUCKETS, seconds)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets' : [0] * (len(BUCKETS) + 1), 'count' : 0, 'sum' : 0.}
+            histogram['buckets'][i] += 1
+            histogram['count'] += 1
+            histogram['sum'] += seconds
+
+    @contextmanager
+    def timer(self, name, **labels):
+        '''
+            Observes the time the with block took in a histogram
+        '''
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.observe(name, time.time() - start, **labels)
+
+    def snapshot(self):
+        '''
+            Returns all metrics as a dictionary that can be dumped to json
+        '''
+        with self.lock:
+            counters = dict(self.counters)
+            histograms = {key : dict(value, buckets=list(value['buckets'])) for key, value in self.histograms.items()}
+
+        return {'time' : time.time(),
+                'uptime' : time.time() - self.started,
+                'counters' : [{'name' : name, 'labels' : dict(labels), 'value' : value}
+                              for (name, labels), value in sorted(counters.items())],
+                'histograms' : [{'name' : name, 'labels' : dict(labels), 'count' : value['count'],
+                                 'sum' : value['sum'], 'buckets' : zip(list(BUCKETS) + ['+Inf'], value['buckets'])}
+                                for (name, labels), value in sorted(histograms.items())]}
+
+    def render(self):
+        '''
+            Returns all metrics in the prometheus text format
+        '''
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, dict(value, buckets=list(value['buckets']))) for key, value in self.histograms.items())
+
+        lines = []
+        described = set()
+
+        def describe(name, kind):
+            if name not in described:
+                described.add(name)
+                if name in HELP:
+                    lines.append('# HELP %s %s' % (name, HELP[name]))
+                lines.append('# TYPE %s %s' % (name, kind))
+
+        for (name, labels), value in counters:
+            describe(name, 'counter')
+            lines.append('%s%s %s' % (name, _format_labels(labels), value))
+
+        for (name, labels), histogram in histograms:
+            describe(name, 'histogram')
+            cumulative = 0
+            for bound, count in zip(list(BUCKETS) + ['+Inf'], histogram['buckets']):
+                cumulative += count
+                lines.append('%s_bucket%s %s' % (name, _format_labels(labels, [('le', bound)]), cumulative))
+            lines.append('%s_sum%s %s' % (name, _format_labels(labels), histogram['sum']))
+            lines.append('%s_count%s %s' % (name, _format_labels(labels), histogram['count']))
+
+        lines.append('# TYPE pykick_uptime_seconds gauge')
+        lines.append('pykick_uptime_seconds %s' % (time.time() - self.started))
+        return '\n'.join(lines) + '\n'
+
+
+# the metrics of this process
+REGISTRY = Registry()
+
+inc = REGISTRY.inc
+observe = REGISTRY.observe
+timer = REGISTRY.timer
+
+
+class _Handler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        body = REGISTRY.render()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        # no line on stderr for every scrape
+        pass
+
+
+def serve(port, host = HOST):
+    '''
+        Serves the metrics of this process in the prometheus text format on http://host:port/ from a
+        background thread, by default only to this machine. Returns the server.
+    '''
+    server = BaseHTTPServer.HTTPServer((host, port), _Handler)
+    thread = threading.Thread(target=server.serve_forever, name='metrics')
+    thread.daemon = True
+    thread.start()
+    logging.getLogger("pykick.metrics").info('Serving metrics on http://%s:%s/', *server.server_address)
+    return server
+
+
+class JSONDump(object):
+    '''
+        Writes the metrics of this process to a json file every interval seconds from a background thread.
+
+        Next to the snapshot of Registry.snapshot, the file has the rate per second of every counter since
+        the last dump, e.g. requests and projects per second.
+    '''
+    def __init__(self, path, interval = DUMP_INTERVAL, registry = REGISTRY):
+        self.path = path
+        self.interval = interval
+        self.registry = registry
+        self.last = None
+        self.stopped = threading.Event()
+
+        self.thread = threading.Thread(target=self.__run, name='metrics-dump')
+        self.thread.daemon = True
+        self.thread.start()
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            self.dump()
+
+    def dump(self):
+        '''
+            Writes the metrics now
+        '''
+        snapshot = self.registry.snapshot()
+
+        rates = []
+        if self.last is not None:
+            elapsed = max(snapshot['time'] - self.last['time'], 1e-9)
+            before = {(c['name'], tuple(sorted(c['labels'].items()))) : c['value'] for c in self.last['counters']}
+            for counter in snapshot['counters']:
+                previous = before.get((counter['name'], tuple(sorted(counter['labels'].items()))), 0)
+                rates.append({'name' : counter['name'], 'labels' : counter['labels'],
+                              'per_second' : (counter['value'] - previous) / elapsed})
+        self.last = snapshot
+
+        # write to a temporary file first, so a reader never sees half a file
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(dict(snapshot, rates=rates), f, indent=1)
+        os.rename(tmp, self.path)
+
+    def stop(self):
+        '''
+            Stops the thread and writes the metrics a last time
+        '''
+        self.stopped.set()
+        self.dump()
+
+
+def start(port = None, path = None, interval = DUMP_INTERVAL, host = HOST):
+    '''
+        Serves the metrics on host:port and / or dumps them to the json file path, whatever is given.
+        Returns the JSONDump or None, call JSONDump.stop at the end to write the final numbers.
+    '''
+    if port:
+        serve(port, host)
+    return JSONDump(path, interval) if path else None
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import os
+
+CATEGORIES_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'categories.txt')
+
+# the discover api hands out at most 200 pages of 20 projects for one query
+RESULT_LIMIT = 4000
+
+STATES = ['live', 'successful', 'failed']
+
+# the most prominent countries, as yahoo woe ids
+WOE_IDS = [2347563, 2459115, 24865675, 24865671, 24865673, 23424977]
+
+# the range filters of the discover page, every project falls into exactly one bucket of each
+GOAL_BUCKETS = range(5)
+RAISED_BUCKETS = range(3)
+PLEDGED_BUCKETS = range(5)
+
+# number of times a slice is probed before it counts as failed, Pykick.probe retries every request as well
+PROBE_ATTEMPTS = 2
+
+# the order in which oversized slices are split up
+DIMENSIONS = ['category_id', 'subcategory', 'goal', 'raised', 'pledged', 'woe_id']
+
+
+def read_categories(categories_file = CATEGORIES_FILE):
+    '''
+        Reads the category ids from categories.txt, where every line looks like '22, art/illustration'.
+
+        Returns a list of the main category ids and a dict main category id -> subcategory ids. The main
+        category of a group is the lowest id with the same name before the '/'.
+    '''
+    groups = {}
+    with open(categories_file, 'r') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            id_, name = line.split(',', 1)
+            groups.setdefault(name.strip().split('/')[0], []).append(int(id_))
+
+    parents = []
+    children = {}
+    for ids in groups.values():
+        ids = sorted(ids)
+        parents.append(ids[0])
+        children[ids[0]] = ids[1:]
+
+    return sorted(parents), children
+
+
+class Partitioner(object):
+    '''
+        Splits up the discover queries so that every project can be reached despite the 4000 results limit.
+
+        Every slice is probed with a single request for its first page. Empty slices are skipped, slices with
+        up to 4000 projects are crawled as they are and only bigger slices are split further: by main category,
+        subcategory, goal, raised and pledged range and finally by country.
+
+        A split by (sub)category or country is only used if the parts add up to the whole slice, otherwise
+        projects without a subcategory or from other countries would get lost. For the same reason no split
+        is used if one of its parts can't be probed, even after a retry.
+
+        Partitioner.slices returns an iterator of (options, first page) tuples. The first page is the
+        response that was downloaded for the probe, so it doesn't have to be downloaded again.
+    '''
+    def __init__(self, kick, categories_file = CATEGORIES_FILE, limit = RESULT_LIMIT):
+        self.logger = logging.getLogger("pykick.Partitioner")
+        self.kick = kick
+        self.limit = limit
+        self.parents, self.children = read_categories(categories_file)
+
+    def __split(self, options, dimension):
+        # the slices options is split into by dimension, plus whether the parts must be checked to add up
+        if dimension == 'category_id':
+            if 'category_id' in options:
+                return [], True
+            return [dict(options, category_id=str(id_)) for id_ in self.parents], True
+
+        if dimension == 'subcategory':
+            children = self.children.get(int(options.get('category_id', 0)), [])
+            return [dict(options, category_id=str(id_)) for id_ in children], True
+
+        if dimension == 'woe_id':
+            return [dict(options, woe_id=str(woe_id)) for woe_id in WOE_IDS], True
+
+        buckets = {'goal' : GOAL_BUCKETS, 'raised' : RAISED_BUCKETS, 'pledged' : PLEDGED_BUCKETS}[dimension]
+        return [dict(options, **{dimension : str(bucket)}) for bucket in buckets], False
+
+    def __probe(self, slices):
+        # get the first page of all slices at once, pairs of (options, first page) come back as they arrive.
+        # The slices whose probe failed are tried once more, returns the probed and the failed slices
+        probed = []
+        failed = slices
+        for attempt in range(PROBE_ATTEMPTS):
+            if not failed:
+                break
+            retry, failed = failed, []
+            for options, first in self.kick.crawler.crawl(self.kick.probe, retry):
+                if first is None:
+                    failed.append(options)
+                else:
+                    probed.append((options, first))
+
+        for options in failed:
+            self.logger.critical("Couldn't probe %s" % options)
+        return probed, failed
+
+    def __partition(self, options, first, dimensions):
+        total = first['total_hits']
+
+        # nothing in here
+        if total == 0:
+            return
+
+        if total <= self.limit:
+            yield options, first
+            return
+
+        for i, dimension in enumerate(dimensions):
+            slices, checked = self.__split(options, dimension)
+            if not slices:
+                continue
+
+            probed, failed = self.__probe(slices)
+            if failed:
+                # the projects of a slice we couldn't probe would be lost, try the next dimension instead
+                self.logger.critical("Splitting by %s lost %s slices of %s, skipping" % (dimension, len(failed), options))
+                continue
+            if checked and sum(first['total_hits'] for _, first in probed) < total:
+                self.logger.info("Splitting by %s doesn't cover %s, skipping" % (dimension, options))
+                continue
+
+            for slice_options, slice_first in probed:
+                for item in self.__partition(slice_options, slice_first, dimensions[i+1:]):
+                    yield item
+            return
+
+        # we can't split any further, get the 4000 newest and the 4000 ending first projects at least
+        self.logger.warning("Can't split %s with %s projects any further" % (options, total))
+        yield options, first
+
+        end_date = dict(options, sort='end_date')
+        first = self.kick.probe(end_date)
+        if first is not None:
+            yield end_date, first
+
+    def slices(self, states = STATES):
+        '''
+            Returns an iterator of (options, first page) tuples, one for every slice that has to be crawled
+        '''
+        for state in states:
+            options = {'state' : state, 'sort' : 'newest'}
+            first = self.kick.probe(options)
+            if first is None:
+                self.logger.critical("Couldn't probe %s" % options)
+                continue
+
+            for item in self.__partition(options, first, DIMENSIONS):
+                yield item
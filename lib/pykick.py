@@ -1,27 +1,54 @@
 # -*- coding: utf-8 -*-
 
 import logging
-import logging.handlers
 import requests
-import json
-import re
 from bs4 import BeautifulSoup
 import lxml   
 import time
+import random
+from email.utils import parsedate_tz, mktime_tz
+import math
+from multiprocessing.pool import ThreadPool
 from datetime import datetime as dt
-import os
-import sys
-print os.path.dirname(sys.executable)
 # Suppress urrlib3 https warnings
 import urllib3
 
+from crawler import Crawler, HostRateLimiter
+from extract import extract_project, extract_creator_data, JSONArrayStream
+from cache import HTTPCache, DEFAULT_SIZE
+import metrics
+import log
 
 
-DISCOVER_URL = 'https://www.kickstarter.com/discover/advanced'
-CATEGORY_URL = 'https://www.kickstarter.com/discover'
-PROJECT_REGEX = re.compile(r'window.current_project = \"(.+)\"')
+
+BASE_URL = 'https://www.kickstarter.com'
+DISCOVER_URL = BASE_URL + '/discover/advanced'
+CATEGORY_URL = BASE_URL + '/discover'
 TIMEOUT = 10.
+PAGE_LIMIT = 200
+# bytes read at once from a streamed response
+CHUNK_SIZE = 16384
 REQUEST_LIMIT = 10
+# retry policy: exponential backoff with full jitter, capped at BACKOFF_MAX seconds
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 60.
+RETRY_AFTER_MAX = 600.
+RETRY_STATUS = (429, 500, 502, 503, 504)
+# request errors that come out the same on every attempt, everything else (connection errors, timeouts, broken
+# or badly encoded bodies) is retried
+FINAL_ERRORS = (requests.exceptions.InvalidURL, requests.exceptions.MissingSchema, requests.exceptions.InvalidSchema,
+                requests.exceptions.URLRequired, requests.exceptions.InvalidHeader, requests.exceptions.TooManyRedirects)
+
+def new_session(pool_size = 8):
+    '''
+        Returns a requests.Session that keeps up to pool_size connections per host alive. A session must not
+        be used across a fork, every process needs its own.
+    '''
+    adapter = requests.adapters.HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session = requests.Session()
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
 
 class Pykick(object):
     '''
@@ -35,33 +62,124 @@ class Pykick(object):
 
 
     '''
-    def __init__(self, loglevel = logging.INFO, logfile = './logs/pykick.log'):
+    def __init__(self, loglevel = logging.INFO, logfile = './logs/pykick.log', workers = 1, concurrency = 8,
+                 rate_limit = None, pool_size = None, max_retries = REQUEST_LIMIT, streaming = False,
+                 cache_dir = None, cache_size = DEFAULT_SIZE, cache_ttls = None, base_url = None, session = None):
         ''' Module to access kickstarter projects
+
+            Parameters:
+                - workers: number of discover pages fetched in parallel by Pykick.get / Pykick.get_newest,
+                           default is 1 (one page after the other)
+                - concurrency: number of project / user pages in flight in Pykick.get_projects and
+                               Pykick.get_creators_data, default is 8
+                - rate_limit: maximum number of requests per second sent to one host, default is None (no limit)
+                - pool_size: number of keep-alive connections kept open per host, default is the larger of
+                             workers and concurrency
+                - max_retries: number of attempts per url before giving up, default is 10
+                - streaming: parse the projects of a discover page while it is downloaded and hand them out one
+                             by one, instead of loading the whole page first. Pages are then fetched one after
+                             the other, even with more than one worker. Default is False
+                - cache_dir: directory for a cache of project, user and category pages, which are then
+                             revalidated with conditional requests instead of downloaded again. Default is None
+                             (no cache)
+                - cache_size: maximum size of the cache in bytes, default is 512 MB
+                - cache_ttls: list of (url regex, seconds) for which cached pages are used without asking the
+                              server, see cache.DEFAULT_TTLS
+                - base_url: the site to crawl instead of https://www.kickstarter.com, e.g. the stand-in server
+                            of the benchmarks. Default is None
+                - session: a requests.Session to share with other Pykick instances of this process, see
+                           new_session. Default is None (a new one, with pool_size connections per host)
         '''
 
-        # create the logger instance and set loglevel
+        # create the logger instance and set loglevel, the handlers are only added once per process
         self.logger = logging.getLogger("pykick.Pykick")
         self.logger.setLevel(loglevel)
+        log.configure(loglevel, logfile)
 
-        # check if the log folder exists, if not make it
-        if not os.path.exists(os.path.dirname(logfile)):
-            os.mkdir(os.path.dirname(logfile))
+        self.workers = workers
+        self.max_retries = max_retries
+        self.streaming = streaming
+        self.crawler = Crawler(concurrency=concurrency)
+        self.rate_limiter = HostRateLimiter(rate=rate_limit)
 
+        # one session for all requests, so connections are kept alive and reused
+        self.session = session or new_session(pool_size or max(workers, concurrency))
 
-        # Lets make one log file per day and keep backups for a week
-        fh = logging.handlers.TimedRotatingFileHandler(logfile, when='D', interval=1, backupCount=7)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        fh.setLevel(loglevel)
-        ch = logging.StreamHandler()
-        ch.setLevel(loglevel)
-        ch.setFormatter(formatter)
-        self.logger.addHandler(fh)
-        self.logger.addHandler(ch)
-        self.requests_counter = 0
+        self.cache = HTTPCache(cache_dir, max_size=cache_size, ttls=cache_ttls) if cache_dir else None
+
+        self.discover_url = base_url + '/discover/advanced' if base_url else DISCOVER_URL
+        self.category_url = base_url + '/discover' if base_url else CATEGORY_URL
 
   
-    def __iter_pages(self, options):
+    def __fetch_page(self, options):
+
+        # Try to get a response using requests from the discover url using options set above
+        r = self.__request(self.discover_url, params=options)
+
+        if r is not None and r.status_code==200:
+            # Got a response, convert it to json!
+            with metrics.timer('pykick_parse_seconds', kind='discover'):
+                return r.json()
+
+        # return None if there was an error, e.g. the url might be broken (in the future this should be
+        # fixed the in the db)
+        self.logger.critical("requests error, status code: %s" % (r.status_code if r is not None else None))
+        return None
+
+    def __log_page(self, page, counter, total_hits):
+        self.logger.info('total_hits: %s', total_hits)
+        self.logger.info("Scanning page: %s"  % page)
+        self.logger.info("Project: %s out of %s" %(counter, total_hits))
+
+    def __iter_pages(self, options, known = None, first_page = None):
+
+        # fetch the remaining pages in parallel if we have more than one worker. If we stop at known projects,
+        # go one page after the other, so we don't download pages we are not going to use. Streamed pages
+        # are parsed while they come in, that only makes sense one page after the other as well
+        if self.workers > 1 and known is None and not self.streaming:
+            return self.__iter_pages_concurrent(options, first_page)
+        return self.__iter_pages_serial(options, known, first_page)
+
+    def __stream_page(self, options):
+
+        # Start downloading a discover page, returns a generator of its projects that parses them while the
+        # page comes in and a dict that gets the rest of the response (e.g. total_hits) once the page is done.
+        # Both are None if there was an error.
+        r = self.__request(self.discover_url, params=options, stream=True)
+
+        if r is None or r.status_code!=200:
+            self.logger.critical("requests error, status code: %s" % (r.status_code if r is not None else None))
+            if r is not None:
+                r.close()
+            return None, None
+
+        resp = {}
+
+        def projects():
+            parser = JSONArrayStream('projects')
+            try:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    for project in parser.feed(chunk):
+                        yield project
+                resp.update(parser.close())
+            except (requests.exceptions.RequestException, ValueError) as e:
+                # the projects we handed out are fine, but we don't know how the page ends
+                self.logger.critical("Page %s broke off: %s" % (options['page'], e))
+            finally:
+                r.close()
+
+        return projects(), resp
+
+    def __iter_page(self, projects, stats, known):
+
+        # hand out the projects of a page, count them and check if they are all known on the way
+        for project in projects:
+            stats['count'] += 1
+            if known and not known(project):
+                stats['known'] = False
+            yield project
+
+    def __iter_pages_serial(self, options, known = None, first_page = None):
 
         # Set the counters to zero
         counter = 0
@@ -70,132 +188,255 @@ class Pykick(object):
 
         while running:
 
-            # Try to get a response using requests from the discover url using options set above
-            r = requests.get(DISCOVER_URL, params=options)
+            # the first page might have been downloaded already, in streaming mode the page is parsed while
+            # it is downloaded and resp is only complete after all its projects were handed out
+            if first_page is not None:
+                projects, resp = first_page['projects'], first_page
+            elif self.streaming:
+                projects, resp = self.__stream_page(options)
+            else:
+                resp = self.__fetch_page(options)
+                projects = resp['projects'] if resp else None
+            first_page = None
+
+            # stop the loop if there was an error
+            if resp is None:
+                break
 
-            if r.status_code==200:
-                # Got a response, convert it to json!
-                resp = r.json()
+            # known is checked before a project is handed out, the projects become known once they are processed
+            stats = {'count' : 0, 'known' : True}
+            page = self.__iter_page(projects, stats, known)
 
-                # There is always a key total_hits, even if we exceeded the page limit, in that case projects is an empty array
-                total_hits = resp['total_hits']
-                # Increase the counter by the number of found projects
-                counter += len(resp['projects'])
+            yield options['page'], page
 
-                # logging
-                self.logger.info('total_hits: %s', total_hits)
-                self.logger.info("Scanning page: %s"  % options['page'])
-                self.logger.info("Project: %s out of %s" %(counter, total_hits))
+            # make sure the whole page was read
+            for _ in page:
+                pass
 
-                yield resp['projects']
+            # a streamed page that broke off, we don't know where we are
+            if 'total_hits' not in resp:
+                break
 
-            # stop the loop if there was an error, e.g. the url might be broken (in the future this should be
-            # fixed the in the db)
-            else:
-                self.logger.critical("requests error, status code: %s" % r.status_code)
+            # There is always a key total_hits, even if we exceeded the page limit, in that case projects is an empty array
+            total_hits = resp['total_hits']
+            # Increase the counter by the number of found projects, if we start at a later page count the
+            # (full) pages before it as well
+            if counter == 0:
+                counter = (options['page'] - 1) * stats['count']
+            counter += stats['count']
+
+            self.__log_page(options['page'], counter, total_hits)
+
+            if known and stats['known']:
+                self.logger.info("Only known projects on page %s, stopping" % options['page'])
+                running = False
+
+            # an empty page means we are past the last project
+            if stats['count'] == 0:
                 running = False
 
             # stop the while loop if we reached the end (page 200) or found all projects, whatever is reached first
-            if (counter == total_hits) or (options['page'] == 200):
+            if (counter == total_hits) or (options['page'] == PAGE_LIMIT):
                 running = False
 
             # go to the next page
             options['page'] += 1
 
-    def __iter_projects(self, options={}):
+    def __iter_pages_concurrent(self, options, first_page = None):
+
+        # the first page is fetched on its own, it tells us how many projects (and pages) there are
+        resp = first_page if first_page is not None else self.__fetch_page(options)
+        if not resp:
+            return
+
+        total_hits = resp['total_hits']
+        # if we start at a later page, count the (full) pages before it as well
+        counter = options['page'] * len(resp['projects'])
+        self.__log_page(options['page'], counter, total_hits)
+        yield options['page'], resp['projects']
+
+        # an empty first page means we are past the page limit or there is nothing to get
+        if counter == 0 or counter >= total_hits:
+            return
+
+        # the page size is set by kickstarter, the first page tells us what it is
+        remaining_pages = int(math.ceil((total_hits - counter) / float(len(resp['projects']))))
+        last_page = min(options['page'] + remaining_pages, PAGE_LIMIT)
+        pages = [dict(options, page=page) for page in range(options['page'] + 1, last_page + 1)]
+        if not pages:
+            return
+
+        # imap hands the pages back in page order, while up to self.workers of them are downloaded at once
+        pool = ThreadPool(min(self.workers, len(pages)))
+        try:
+            for page_options, resp in zip(pages, pool.imap(self.__fetch_page, pages)):
+                # stop at the first error, just like the serial version
+                if not resp:
+                    break
+
+                counter += len(resp['projects'])
+                self.__log_page(page_options['page'], counter, resp['total_hits'])
+
+                yield page_options['page'], resp['projects']
+
+                if not resp['projects']:
+                    break
+        finally:
+            pool.terminate()
+
+    def __iter_projects(self, options={}, known = None, first_page = None):
 
         # the default starting page is 1, this could also be changed by hand to start at a later page (maximum 200)
         options.setdefault('page', 1)
         options['format'] = 'json'
 
         # go through all the pages and emit individual projects
-        for page in self.__iter_pages(options):
-            for project in page:
+        for _, projects in self.__iter_pages(options, known, first_page):
+            for project in projects:
                 yield project
 
 
+    def __retry_after(self, r):
+
+        # Retry-After is either a number of seconds or a http date
+        value = r.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            seconds = float(value)
+        except ValueError:
+            date = parsedate_tz(value)
+            if date is None:
+                return None
+            seconds = mktime_tz(date) - time.time()
+        return min(max(seconds, 0.), RETRY_AFTER_MAX)
+
+    def __request(self, url, params = None, stream = False, headers = None):
+
+        # every call keeps its own attempt count, so retries for one url don't use up the attempts of another
+        for attempt in range(1, self.max_retries + 1):
+            self.rate_limiter.wait(url)
+
+            start = time.time()
+            try:
+                r = self.session.get(url, params=params, timeout = TIMEOUT, stream = stream, headers = headers)
+            except FINAL_ERRORS as e:
+                metrics.inc('pykick_http_requests_total', status='error')
+                self.logger.critical("Can't request %s: %s" % (url, e))
+                return None
+            except requests.exceptions.RequestException as e:
+                self.logger.warning("No response, url: %s \n Error: %s" % (url, e))
+                r = None
+            metrics.observe('pykick_http_request_seconds', time.time() - start)
+            metrics.inc('pykick_http_requests_total', status=r.status_code if r is not None else 'error')
+
+            # anything but a request error, 429 or a server error is final
+            if r is not None and r.status_code not in RETRY_STATUS:
+                return r
+
+            if attempt == self.max_retries:
+                break
+            metrics.inc('pykick_http_retries_total')
+
+            retry_after = self.__retry_after(r) if r is not None else None
+            if r is not None:
+                # give the connection back to the pool before we wait, a streamed response would hold on to it
+                r.close()
+            if retry_after is not None:
+                # the server told us how long to wait, hold back all requests to this host until then
+                self.logger.warning("status code %s, retrying %s in %.1fs (attempt %i out of %i)",
+                                    r.status_code, url, retry_after, attempt, self.max_retries)
+                self.rate_limiter.pause(url, retry_after)
+            else:
+                delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+                self.logger.warning("retrying %s in %.1fs (attempt %i out of %i)",
+                                    url, delay, attempt, self.max_retries)
+                time.sleep(delay)
+
+        self.logger.critical("gave up on %s after %i attempts", url, self.max_retries)
+        return r
+
     def __handle_request(self, url):
 
+        # use the cached page if it is recent enough, otherwise ask the server if it changed
+        cached = self.cache.get(url) if self.cache else None
+        if cached and self.cache.is_fresh(cached):
+            r = self.cache.response(cached)
+            if r is not None:
+                metrics.inc('pykick_cache_total', result='fresh')
+                return r
+            cached = None
+
         # try to contact the url
-        try:
-            r = requests.get(url, timeout = TIMEOUT)
-        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
-            self.logger.warning("No response, url: %s \n Error: %s" % (url, e))
+        r = self.__request(url, headers=self.cache.validators(cached) if cached else None)
+        if r is None:
             return None
 
+        # not modified, the cached page is still good
+        if r.status_code==304 and cached:
+            cached_r = self.cache.response(cached)
+            if cached_r is not None:
+                self.cache.refresh(cached)
+                metrics.inc('pykick_cache_total', result='revalidated')
+                return cached_r
+            # the cached page is gone, get it again without conditions
+            r = self.__request(url)
+            if r is None:
+                return None
+
         # if the status code is not 200, log the error
         if r.status_code!=200:
             self.logger.critical("No response, url: %s, status code: %s", url, r.status_code)
             return None
 
-        else:
-            return r
+        if self.cache:
+            metrics.inc('pykick_cache_total', result='miss')
+            self.cache.store(url, r)
+        return r
 
 
     def __extract_data(self, r):
 
-        # Search for the project data in the response text and extract the json data if there is one
-        project_text = PROJECT_REGEX.search(r.text).groups()
-        if project_text:
-
-            # fix some html chars for quotes, replace excess slashs
-            project_text = project_text[0].replace('&quot;','"').replace('\\\\','\\')
-
-            # if we can convert the response into a json, return it, otherwise raise an error and return None
-            try:
-                resp = json.loads(project_text)
-                return resp
-            except ValueError, e:
-                self.logger.critical("Error in loading request into JSON")
-                self.logger.critical(e)
-                return None
+        # Search for the project data in the raw response and extract the json data if there is one,
+        # decoding the whole page into r.text isn't needed for that
+        try:
+            with metrics.timer('pykick_parse_seconds', kind='project'):
+                project = extract_project([r.content])
+        except ValueError as e:
+            # if we can't convert the response into a json, return None
+            self.logger.critical("Error in loading request into JSON")
+            self.logger.critical(e)
+            return None
 
         # if there was no project, return none
-        else:
+        if project is None:
             self.logger.critical("No project text found on project page")
-            return None
+        return project
 
     def __extract_creator_data(self, r, url):
 
-        # load the url text into beautifulsoup
-        print url
-       # print r.text
-        i = 0
-        try:
-            soup = BeautifulSoup(r.text, 'html.parser')
-            print 'no error'
-            i = 1
-        except:
-            print 'error'
-
-        if i == 1:
-            try:
-                # Try to find the nav lists and all 'a' elements within
-                list_items = soup.findAll('li', {'class', 'nav--subnav__item'})
-            except IndexError as e:
-                # if we can't find project_nav, we raise an error
-                self.logger.info('Couldnt get user page, user page deleted? %s', url)
-                return None
-
+        # no response, the user page might be deleted
+        if r is None:
+            self.logger.info('Couldnt get user page, user page deleted? %s', url)
+            return None
 
-            # create a dict for the listed data found in project_nav. This should be: backed, created and comments counts
-            try:
-                creator_data = {item.text.split()[0]:item.text.split()[1] for item in list_items if len(item.text.split())>1}
-                self.logger.info('Updated creator data: %s', creator_data)
-            except AttributeError as e:
-                self.logger.warning('Failed to extract creator data: %s', list_items)
-            return creator_data
-        return None
+        # create a dict for the listed data found in the sub navigation. This should be: backed, created and comments counts
+        with metrics.timer('pykick_parse_seconds', kind='creator'):
+            creator_data = extract_creator_data(r.content)
+        self.logger.debug('Updated creator data: %s', creator_data)
+        return creator_data
 
-    def get_newest(self,options={}):
+    def get_newest(self,options={}, known = None):
         '''
             Returns an iterator for the newest projects at kickstarter
+
+            If known is given, the iteration stops after the first page with only known projects, see Pykick.get
         '''
         options.setdefault('sort', 'newest')
-        return self.get(options)
+        return self.get(options, known)
 
 
-    def get(self, options = {}):
+    def get(self, options = {}, known = None, first_page = None):
         '''
             Returns an iterator for projects that returns dicts of individual project records. By default
             the format is 'json'.
@@ -204,9 +445,34 @@ class Pykick(object):
 
             E.g.: options = {'sort' : 'most_funded', 'format' : 'json', 'category_id' : 3}
                     to find projects from the category 'comics' (3), sorted by funding and in json format.
+
+            known is an optional function that is called with every project and returns True if the project
+            was seen before. The pagination stops after the first page on which all projects are known.
+
+            first_page is the response for the first page if it was already downloaded with Pykick.probe,
+            it is used instead of downloading the page again.
+        '''
+
+        return self.__iter_projects(options, known, first_page)
+
+    def get_pages(self, options = {}, known = None, first_page = None):
         '''
+            Same as Pykick.get, but returns an iterator of (page number, projects) tuples, one per discover page.
+            projects is an iterable of the projects on the page, it has to be read before the next page.
+            Useful to keep track of the pages that were processed already.
+        '''
+        options.setdefault('page', 1)
+        options['format'] = 'json'
 
-        return self.__iter_projects(options)
+        return self.__iter_pages(options, known, first_page)
+
+    def probe(self, options):
+        '''
+            Downloads only the first page for the given options and returns the response as a dictionary,
+            or None if there was an error. The response has the keys 'total_hits' and 'projects'.
+        '''
+        options = dict(options, page=1, format='json')
+        return self.__fetch_page(options)
 
     def get_categories(self):
         '''
@@ -217,12 +483,12 @@ class Pykick(object):
         '''
         categories = {}
 
-        r = requests.get(CATEGORY_URL)
-        if r.status_code==200:
+        r = self.__handle_request(self.category_url)
+        if r:
             soup = BeautifulSoup(r.text)
         else:
-            self.logger.critical("Couldn't get soupify category page %s" % CATEGORY_URL)
-            self.logger.critical('requests status code: %s' % r.status_code)
+            self.logger.critical("Couldn't get soupify category page %s" % self.category_url)
+            return categories
 
 
         counts = soup.find_all('div', {'class' : 'h4 bold'})
@@ -251,25 +517,13 @@ class Pykick(object):
             Returns: a python dictionary with the project data
         '''
 
-        # Let's try to get the project data
+        # Let's try to get the project data, __handle_request already retried if there was no answer
         r = self.__handle_request(project_url)
         if r:
-            # If we got an answer, reset the requests counter and return the project
-            self.requests_counter = 0
-            project = self.__extract_data(r)
-            return project
-
-        else:
-            # We got no response, if the request counter is still smaller than request limit, try again
-            self.logger.critical('received empty project! url, trying again: %s' % project_url)
-            if self.requests_counter < REQUEST_LIMIT:
-                self.logger.critical("attempt %i out of %i" % (self.requests_counter, REQUEST_LIMIT))
-                self.requests_counter += 1
-                self.get_project(project_url)
-            else:
-                self.logger.critical("gave up to get project %s" % project_url)
-                return None
+            return self.__extract_data(r)
 
+        self.logger.critical("gave up to get project %s" % project_url)
+        return None
 
 
     def get_creator_data(self, creator_url):
@@ -284,3 +538,22 @@ class Pykick(object):
         r = self.__handle_request(creator_url)
 
         return self.__extract_creator_data(r, creator_url)
+
+
+    def get_projects(self, project_urls):
+        '''
+            Scrapes many project pages at the same time, see Pykick.get_project.
+
+            Input: an iterable of project urls, e.g. a generator over a database cursor
+            Returns: an iterator of (url, project) tuples, in the order the pages were received
+        '''
+        return self.crawler.crawl(self.get_project, project_urls)
+
+    def get_creators_data(self, creator_urls):
+        '''
+            Scrapes many user pages at the same time, see Pykick.get_creator_data.
+
+            Input: an iterable of user urls
+            Returns: an iterator of (url, creator data) tuples, in the order the pages were received
+        '''
+        return self.crawler.crawl(self.get_creator_data, creator_urls)
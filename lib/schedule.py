@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+
+import time
+import datetime
+
+# bounds for the time between two refreshes of a live project, in seconds
+MIN_INTERVAL = 15 * 60
+MAX_INTERVAL = 24 * 3600
+
+# share of the time left until the deadline that may pass between two refreshes
+DEADLINE_SHARE = 0.1
+
+# a project that moves by this share of its goal (or of its backers) per hour is refreshed twice as often
+VELOCITY_SCALE = 0.01
+
+
+def velocity(project, previous):
+    '''
+        Relative change per hour of pledged (as a share of the goal) and backers_count between the stored
+        record previous and the freshly scraped project.
+    '''
+    if not previous or not previous.get('updated'):
+        return 0.
+
+    hours = max((datetime.datetime.utcnow() - previous['updated']).total_seconds() / 3600., 1 / 60.)
+
+    pledged = abs(float(project['pledged']) - float(previous.get('pledged', 0))) / max(float(project['goal']), 1.)
+    backers = abs(project['backers_count'] - previous.get('backers_count', 0)) / max(float(project['backers_count']), 1.)
+
+    return (pledged + backers) / hours
+
+
+def next_refresh(project, previous = None):
+    '''
+        Returns the time (utc datetime) a live project is due to be refreshed again.
+
+        The closer the deadline, the sooner: at most DEADLINE_SHARE of the remaining time passes until the next
+        refresh. Projects whose pledged amount or backers moved since the last refresh come sooner as well,
+        dormant campaigns are refreshed at most once every MAX_INTERVAL.
+
+        project is the freshly scraped project with the deadline as a timestamp, previous is its record in the
+        database with the fields 'pledged', 'backers_count' and 'updated', or None.
+    '''
+    time_left = project['deadline'] - time.time()
+
+    interval = time_left * DEADLINE_SHARE
+    interval /= 1. + velocity(project, previous) / VELOCITY_SCALE
+    interval = min(max(interval, MIN_INTERVAL), MAX_INTERVAL)
+
+    return datetime.datetime.utcnow() + datetime.timedelta(seconds=interval)
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+
+from array import array
+from bisect import bisect_left
+import heapq
+from itertools import izip
+
+# the project states known on kickstarter, every state is stored as its position in this list
+STATES = ['live', 'successful', 'failed', 'canceled', 'suspended', 'purged', 'started', 'submitted']
+
+# number of new projects collected in a dict before they are merged into the arrays
+MERGE_SIZE = 10000
+
+
+class StateIndex(object):
+    '''
+        A compact in-memory lookup of project id -> state and fingerprint (see fingerprint.fingerprint).
+
+        The ids are kept in a sorted array of longs (8 bytes on 64 bit linux), the states as one byte per
+        project in a bytearray and the fingerprints in an array of unsigned 32 bit integers, around 13 bytes
+        per project. Projects that are not
+        in the arrays yet are collected in a small dict, which is merged into the arrays once it holds
+        MERGE_SIZE projects.
+    '''
+    def __init__(self):
+        self.states = list(STATES)
+        self.ids = array('l')
+        self.codes = bytearray()
+        self.fingerprints = array('I')
+        self.recent = {}
+
+    def __code(self, state):
+        # states we don't know yet get the next free code
+        try:
+            return self.states.index(state)
+        except ValueError:
+            self.states.append(state)
+            return len(self.states) - 1
+
+    def __find(self, id_):
+        # position of id_ in the sorted arrays, or None
+        i = bisect_left(self.ids, id_)
+        if i < len(self.ids) and self.ids[i] == id_:
+            return i
+        return None
+
+    def load(self, cursor):
+        '''
+            Fills the index from a cursor over documents with the fields 'id', 'state' and optionally 'fingerprint'
+        '''
+        ids = array('l')
+        codes = bytearray()
+        fingerprints = array('I')
+        for doc in cursor:
+            ids.append(doc['id'])
+            codes.append(self.__code(doc['state']))
+            fingerprints.append(doc.get('fingerprint', 0))
+
+        # sort the arrays by id
+        order = sorted(xrange(len(ids)), key=ids.__getitem__)
+        self.ids = array('l', (ids[i] for i in order))
+        self.codes = bytearray(codes[i] for i in order)
+        self.fingerprints = array('I', (fingerprints[i] for i in order))
+        self.recent = {}
+
+    def get(self, id_, default = None):
+        '''
+            Returns the state of the project with the given id, or default if the project is unknown
+        '''
+        if id_ in self.recent:
+            return self.states[self.recent[id_][0]]
+
+        i = self.__find(id_)
+        if i is None:
+            return default
+        return self.states[self.codes[i]]
+
+    def fingerprint(self, id_):
+        '''
+            Returns the fingerprint of the project with the given id, 0 if it has none or is unknown
+        '''
+        if id_ in self.recent:
+            return self.recent[id_][1]
+
+        i = self.__find(id_)
+        if i is None:
+            return 0
+        return self.fingerprints[i]
+
+    def set(self, id_, state, fingerprint = 0):
+        '''
+            Sets the state and fingerprint of a project, adds the project if it is unknown
+        '''
+        code = self.__code(state)
+
+        i = self.__find(id_)
+        if i is not None:
+            self.codes[i] = code
+            self.fingerprints[i] = fingerprint
+            return
+
+        self.recent[id_] = (code, fingerprint)
+        if len(self.recent) >= MERGE_SIZE:
+            self.__merge()
+
+    def __merge(self):
+        # merge the new projects into the sorted arrays
+        merged = heapq.merge(izip(self.ids, izip(self.codes, self.fingerprints)), sorted(self.recent.items()))
+        ids = array('l')
+        codes = bytearray()
+        fingerprints = array('I')
+        for id_, (code, fingerprint) in merged:
+            ids.append(id_)
+            codes.append(code)
+            fingerprints.append(fingerprint)
+        self.ids, self.codes, self.fingerprints, self.recent = ids, codes, fingerprints, {}
+
+    def __contains__(self, id_):
+        return id_ in self.recent or self.__find(id_) is not None
+
+    def __len__(self):
+        return len(self.ids) + len(self.recent)
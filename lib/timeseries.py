@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+import datetime
+import pymongo
+from pymongo import UpdateOne
+
+# maximum number of samples in one bucket, a project gets another bucket for the same day when one is full
+BUCKET_SIZE = 200
+
+# the fields of a project that make up a status sample
+SAMPLE_FIELDS = ('goal', 'pledged', 'usd_pledged', 'backers_count', 'state')
+
+# a sample is only stored if one of these changed since the last sample of the project
+CHANGE_FIELDS = ('pledged', 'backers_count', 'state')
+
+
+class StatusSeries(object):
+    '''
+        The status history of projects in a separate collection of buckets, instead of an ever growing
+        'status' array in every project document.
+
+        A bucket holds up to BUCKET_SIZE samples of one project on one (utc) day:
+
+            {'project' : id, 'day' : datetime, 'n' : 3, 'first' : datetime, 'last' : datetime,
+             'latest' : {...}, 'samples' : [{'time' : datetime, 'goal' : ..., 'pledged' : ..., ...}, ...]}
+
+        Samples in which pledged, backers_count and state are the same as in the sample before are dropped.
+    '''
+    def __init__(self, collection, bucket_size = BUCKET_SIZE):
+        self.collection = collection
+        self.bucket_size = bucket_size
+
+        # project id -> the change fields of its latest sample, only for projects seen by this process
+        self.latest = {}
+
+    def ensure_indexes(self):
+        '''
+            Creates the index on project and day the buckets are found with
+        '''
+        self.collection.create_index([('project', pymongo.ASCENDING), ('day', pymongo.ASCENDING)], background=True)
+
+    def __changes(self, sample):
+        return tuple(sample.get(field) for field in CHANGE_FIELDS)
+
+    def __load_latest(self, ids):
+        # the latest sample of the projects we haven't seen yet, one query for all of them
+        ids = [id_ for id_ in ids if id_ not in self.latest]
+        if not ids:
+            return
+
+        buckets = self.collection.aggregate([{'$match' : {'project' : {'$in' : ids}}},
+                                             {'$sort' : {'project' : 1, 'last' : -1}},
+                                             {'$group' : {'_id' : '$project', 'latest' : {'$first' : '$latest'}}}])
+        for bucket in buckets:
+            self.latest[bucket['_id']] = self.__changes(bucket['latest'])
+
+    def operations(self, projects):
+        '''
+            Returns the updates that add a sample of every project to its bucket, for a bulk write.
+            Projects that didn't change since their latest sample get none.
+
+            projects are project documents with a datetime in 'updated', the time of the sample.
+        '''
+        self.__load_latest(list(set(project['id'] for project in projects)))
+
+        operations = []
+        for project in projects:
+            sample = {field : project[field] for field in SAMPLE_FIELDS}
+            changes = self.__changes(sample)
+            if self.latest.get(project['id']) == changes:
+                continue
+            self.latest[project['id']] = changes
+
+            sample['time'] = project['updated']
+            day = datetime.datetime.combine(sample['time'].date(), datetime.time())
+
+            # the bucket of the day that still has room, a new one is created if there is none
+            operations.append(UpdateOne({'project' : project['id'], 'day' : day, 'n' : {'$lt' : self.bucket_size}},
+                                        {'$push' : {'samples' : sample},
+                                         '$inc' : {'n' : 1},
+                                         '$min' : {'first' : sample['time']},
+                                         '$max' : {'last' : sample['time']},
+                                         '$set' : {'latest' : sample}},
+                                        upsert=True))
+        return operations
+
+    def write(self, projects):
+        '''
+            Stores a sample of every project that changed, returns the number of samples stored
+        '''
+        operations = self.operations(projects)
+        if operations:
+            # ordered, so the samples of a project stay in order within a bucket
+            self.collection.bulk_write(operations, ordered=True)
+        return len(operations)
+
+    def samples(self, project_id, start = None, end = None, fields = None):
+        '''
+            Returns the samples of a project in order of time, optionally only those between the datetimes
+            start and end, and only with the given fields (and 'time')
+        '''
+        query = {'project' : project_id}
+        if start is not None or end is not None:
+            # buckets are only skipped by their day, the samples are filtered below
+            query['day'] = {}
+            if start is not None:
+                query['day']['$gte'] = datetime.datetime.combine(start.date(), datetime.time())
+            if end is not None:
+                query['day']['$lte'] = end
+
+        projection = {'_id' : 0, 'samples' : 1}
+        if fields is not None:
+            projection = {'_id' : 0, 'samples.time' : 1}
+            projection.update(('samples.' + field, 1) for field in fields)
+
+        samples = []
+        for bucket in self.collection.find(query, projection).sort([('day', pymongo.ASCENDING),
+                                                                    ('first', pymongo.ASCENDING)]):
+            samples.extend(sample for sample in bucket['samples']
+                           if (start is None or sample['time'] >= start) and (end is None or sample['time'] <= end))
+        return samples
+
+    def pledged_curve(self, project_id, start = None, end = None):
+        '''
+            Returns the pledged amount of a project over time as a list of (datetime, pledged)
+        '''
+        return [(sample['time'], sample['pledged'])
+                for sample in self.samples(project_id, start, end, fields=('pledged',))]
@@ -2,13 +2,32 @@
 
 import logging
 from pykick import Pykick
+import log
+from states import StateIndex
+from partition import Partitioner
+from checkpoints import Checkpoints
+from timeseries import StatusSeries
+from workqueue import WorkQueue, LeaseLost, worker_name
+import export
+import metrics
+import fingerprint
+import schedule
 import pymongo
+from pymongo import UpdateOne, UpdateMany
 import time
 import datetime
+from collections import OrderedDict, Counter
 import os
-import sys
 
-kick = Pykick(loglevel=logging.INFO)
+# number of projects read from the database at once in update_creator_data and update_live_projects
+CREATOR_CHUNK = 2000
+LIVE_CHUNK = 500
+
+# the index the state index is loaded from, so the load only reads the index and not the projects
+STATES_INDEX = [('id', pymongo.ASCENDING), ('state', pymongo.ASCENDING), ('fingerprint', pymongo.ASCENDING)]
+
+# the queries of Update.query_plans that should be answered from the index alone
+COVERED_QUERIES = ('state index',)
 
 class Update(object):
     '''
@@ -21,35 +40,144 @@ class Update(object):
         - port: mongodb server port, default is 27015
         - database: db to use, default is 'kickstarter'
         - collection: collection to use, default is 'projects'
+        - batch_size: number of projects written to the database in one bulk write, default is 500
+        - flush_interval: seconds after which queued projects are written even if the batch isn't full,
+                          default is 10
+        - creator_ttl: seconds for which scraped creator data is reused, default is a week
+        - status_buckets: store the status history of live projects in the collection '<collection>_status'
+                          instead of the 'status' array of each project, see timeseries.StatusSeries.
+                          Default is False
+        - shard: (index, count), only handle the projects and creators whose id modulo count is index in
+                 update_live_projects and update_creator_data, default is None (all of them)
+        - client: a MongoClient to use instead of connecting to host / port / uri, e.g. a mongomock.MongoClient
+        - kick: the Pykick to crawl with, default is None (one with loglevel and logfile, made when it is
+                first needed)
+        - kick_args: more options of the Pykick made by Update, e.g. {'workers' : 4}, see Pykick.__init__.
+                     Default is None
+
+     Nothing is done before it is needed: the connection to mongodb is made, the indexes are ensured and
+     the states of the projects are loaded on first use. A process forked after that connects again, a
+     MongoClient must not be used across a fork.
 
     '''
 
-    def __init__(self, host = 'localhost', port = 27017, uri = None, db = 'kickstarter', collection = 'projects', loglevel = logging.INFO, logfile='./logs/pykick.log'):
+    def __init__(self, host = 'localhost', port = 27017, uri = None, db = 'kickstarter', collection = 'projects', loglevel = logging.INFO, logfile='./logs/pykick.log',
+                 batch_size = 500, flush_interval = 10., creator_ttl = 7 * 24 * 3600, status_buckets = False,
+                 shard = None, client = None, kick = None, kick_args = None):
 
 
         self.logger = logging.getLogger("pykick.update")
         self.logger.setLevel(logging.INFO)
+        log.configure(loglevel, logfile)
+        self.loglevel = loglevel
+        self.logfile = logfile
+
+        # the connection to mongodb is made on first use, see Update.__connect
+        self.__mongo_args = dict(host=host, port=port, uri=uri)
+        self.__client = client
+        self.__own_client = client is None
+        self.__db_name = db
+        self.__collection_name = collection
+        self.__status_buckets = status_buckets
+        self.__pid = None
+
+        self.__kick = kick
+        self.__own_kick = kick is None
+        self.__kick_args = dict(kick_args or {})
+        self.__kick_pid = None
+        self.__states = None
+
+        self.creator_ttl = creator_ttl
+        self.shard = shard
+
+        # projects waiting to be written to the database, see Update.flush
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = []
+        self.last_flush = time.time()
+
+        # projects written, unchanged projects skipped and status samples taken, see Update.log_counts
+        self.counts = Counter()
+
+    def __connect(self):
+        # connects on first use, and again in a process forked since then, unless the client was given
+        if self.__pid == os.getpid():
+            return
+        if self.__own_client:
+            # connect=False: no monitor threads are started before the first operation
+            self.__client = self.__mongodb_connect(connect=False, **self.__mongo_args)
+        self.__pid = os.getpid()
+
+        db = self.__client[self.__db_name]
+        collection = self.__collection_name
+        self.__collection = db[collection]
+
+        # scraped creator data, shared by all projects of a creator
+        self.__creators = db[collection + '_creators']
+
+        # progress of get_all_projects, so a sweep can be resumed
+        self.__checkpoints = Checkpoints(db[collection + '_checkpoints'])
+
+        # the slices of a sweep shared by several workers, see Update.plan_slices and Update.work_slices
+        self.__tasks = WorkQueue(db[collection + '_tasks'])
+
+        # the status history, if it isn't kept in the projects
+        self.__series = StatusSeries(db[collection + '_status']) if self.__status_buckets else None
+
+        self.ensure_indexes()
+
+    @property
+    def collection(self):
+        self.__connect()
+        return self.__collection
+
+    @property
+    def creators(self):
+        self.__connect()
+        return self.__creators
+
+    @property
+    def checkpoints(self):
+        self.__connect()
+        return self.__checkpoints
+
+    @property
+    def tasks(self):
+        self.__connect()
+        return self.__tasks
+
+    @property
+    def series(self):
+        self.__connect()
+        return self.__series
+
+    @property
+    def kick(self):
+        '''
+            The Pykick of this Update, made on first use and again in a forked process, so the connections
+            of its session aren't shared between processes
+        '''
+        if self.__own_kick and self.__kick_pid != os.getpid():
+            self.__kick = Pykick(loglevel=self.loglevel, logfile=self.logfile, **self.__kick_args)
+            self.__kick_pid = os.getpid()
+        return self.__kick
 
-        if not os.path.exists(os.path.dirname(logfile)):
-            os.mkdir(os.path.dirname(logfile))
-
-        # Lets make one log file per day and keep backups for a week
-        fh = logging.handlers.TimedRotatingFileHandler(logfile, when='D', interval=1, backupCount=7)
-        formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-        fh.setFormatter(formatter)
-        fh.setLevel(loglevel)
-        
-        ch = logging.StreamHandler()
-        ch.setLevel(loglevel)
-        ch.setFormatter(formatter)
-        
-        self.logger.addHandler(ch)
-        self.logger.addHandler(fh)
-
-        # Set up the connection to the mongodb collection
-        connection = self.__mongodb_connect(host=host, port=port, uri = uri)
-        db = connection[db]
-        self.collection = db[collection]
+    @property
+    def states(self):
+        '''
+            The states of all projects in the database, loaded once on first use so we don't have to look
+            them up for every project
+        '''
+        if self.__states is None:
+            states = StateIndex()
+            states.load(self.__states_cursor().batch_size(10000))
+            self.logger.info('Loaded the states of %s projects' % len(states))
+            self.__states = states
+        return self.__states
+
+    def __states_cursor(self):
+        # the ids, states and fingerprints of all projects, a covered query of STATES_INDEX
+        return self.collection.find({}, {'id' : 1, 'state' : 1, 'fingerprint' : 1, '_id' : 0}).hint(STATES_INDEX)
 
     def __to_datetime(self, obj):
         # if the obj was already datetime, do nothing
@@ -60,15 +188,15 @@ class Update(object):
             return datetime.datetime.fromtimestamp(obj)
 
 
-    def __mongodb_connect(self, host, port, uri):
+    def __mongodb_connect(self, host, port, uri, connect = True):
         if uri:
             try:
-                return pymongo.MongoClient(uri)
+                return pymongo.MongoClient(uri, connect=connect)
             except (pymongo.errors.ConnectionFailure, pymongo.errors.ServerSelectionTimeoutError) as e:
                 print "Failed to connect to server {}".format(host, port, e)
         else:
             try:
-                return pymongo.MongoClient(host=host, port=port)
+                return pymongo.MongoClient(host=host, port=port, connect=connect)
             except (pymongo.errors.ConnectionFailure, pymongo.errors.ServerSelectionTimeoutError) as e:
                 print "Failed to connect to server {}".format(host, port, e)
                 
@@ -92,101 +220,310 @@ class Update(object):
             project[key] = float(project[key])
         return project
 
-    def get_all_projects(self):
+    def get_all_projects(self, resume = False):
         '''
-        Scans through all category ids and inserts
+        Scans through all slices of the discover page and inserts
         the projects found into the mongodb database
 
+        The slices are found by the Partitioner: every state is split by category, subcategory, goal, raised
+        and pledged ranges until no slice has more than the 4000 projects the api hands out for one query.
+
+        The finished pages of every slice are recorded in a checkpoints collection. With resume = True
+        a sweep that was interrupted continues after the last recorded page, otherwise it starts from scratch.
         '''
 
-        # Scan through the category ids that are known from our records ('categories.txt')
-        with open('./lib/categories.txt', 'r') as f:
-            cats =  f.readlines()
-        cat_ids = [int(cat.split(',')[0]) for cat in cats]
+        if not resume:
+            self.checkpoints.clear()
+
+        partitioner = Partitioner(self.kick)
+
+        try:
+            for options, first_page in partitioner.slices():
+
+                checkpoint = self.checkpoints.get(options)
+                if checkpoint and checkpoint.get('done'):
+                    self.logger.info("skipping finished slice: %s" % options)
+                    continue
+
+                self.__crawl_slice(options, first_page, checkpoint)
+        finally:
+            self.flush()
+            self.log_counts()
+
+    def __crawl_slice(self, options, first_page = None, checkpoint = None, on_page = None):
+        # Logging which slice we are scanning
+        if first_page:
+            self.logger.info("scanning slice: %s with %s projects" % (options, first_page['total_hits']))
+        else:
+            self.logger.info("scanning slice: %s" % options)
+
+        if checkpoint and checkpoint.get('page'):
+            # continue after the last page we got, the probed first page is of no use then
+            pages = self.kick.get_pages(options=dict(options, page=checkpoint['page'] + 1))
+        else:
+            # the first page may have been downloaded to probe the slice already
+            pages = self.kick.get_pages(options=dict(options), first_page=first_page)
+
+        for page, projects in pages:
+            for project in projects:
+                if project:
+                    self.insert_to_database(project)
+            # written together with the projects, see Update.flush
+            self.checkpoints.page_done(options, page)
+            if on_page:
+                on_page(page)
 
-        # Get projects for every category id available
-        sorts = ['newest', 'end_date']
+        self.checkpoints.slice_done(options)
+
+    def prepare_slices(self, resume = False):
+        '''
+        Opens the task queue (the collection '<collection>_tasks') of a sweep shared by several workers.
 
-        # additionally split up by most prominent countries to get more projects
-        woe_ids = [2347563, 2459115, 24865675, 24865671, 24865673, 23424977]
-        for woe_id in woe_ids:
-            for category_id in cat_ids[::-1]:
-                for state in ['live','successful','failed']:
-                    for sort in sorts:
-                        options = {
-                        'format' : 'json',
-                        'category_id' : str(category_id),
-                        'sort' : sorts,
-                        'woe_id'
-                        'state' : state
-                        }
+        Without resume the queue and the checkpoints are reset first, so this has to happen before the workers
+        start. With resume the slices that are done already stay done, the failed ones are tried again.
+        '''
+        if not resume:
+            self.tasks.reset()
+            self.checkpoints.clear()
+        self.tasks.open()
 
-                    # Logging which id we are scanning
-                        self.logger.info("scanning category ID: %s"  % (category_id))
+    def plan_slices(self):
+        '''
+        Runs the partitioner and puts every slice of the discover page into the task queue, for Update.work_slices
+        in one or more processes, on one or more machines sharing the database. The queue is closed at the end.
+        '''
+        partitioner = Partitioner(self.kick)
 
-                        for project in kick.get(options=options):
-                            if project:
-                                self.insert_to_database(project)
+        count = 0
+        for options, first_page in partitioner.slices():
+            self.tasks.put(self.checkpoints.key(options), options)
+            count += 1
 
+        self.tasks.close()
+        self.logger.info('Queued %s slices' % count)
 
-  
-    def get_newest_projects(self):
+    def work_slices(self, poll_interval = 5.):
+        '''
+        Claims slices from the task queue and crawls them, until the queue is closed and all slices are done.
+
+        Every claimed slice belongs to this process until it is done. If the process dies, another worker takes
+        the slice over once its lease ran out and continues after the last page in the checkpoints. A process
+        that was too slow to extend its lease stops crawling the slice as soon as it notices. An error in a slice
+        is logged and the slice is given back, after WorkQueue.max_attempts claims it is marked as failed.
+        '''
+        worker = worker_name()
+
+        def extend(task):
+            if not self.tasks.extend(task, worker):
+                raise LeaseLost(task['_id'])
+
+        try:
+            while True:
+                task = self.tasks.claim(worker)
+                if task is None:
+                    if self.tasks.finished():
+                        break
+                    # the planner is still splitting, or other workers are busy with the last slices
+                    time.sleep(poll_interval)
+                    continue
+
+                options = task['payload']
+                try:
+                    self.__crawl_slice(options, checkpoint=self.checkpoints.get(options),
+                                       on_page=lambda page: extend(task))
+                    # the slice is only done when its projects are in the database
+                    self.flush()
+                except LeaseLost:
+                    # another worker has the slice now, the progress is theirs to record. The projects we got are fine
+                    self.logger.warning('Lost the lease of slice %s, leaving it to the worker that took it over' % options)
+                    self.checkpoints.discard()
+                    self.flush()
+                    continue
+                except Exception as e:
+                    # one bad slice must not stop the worker, the next claim hands it to another one (or to this
+                    # one again) until it failed too often
+                    self.logger.exception('Slice %s failed (attempt %s)' % (options, task.get('attempts')))
+                    if self.tasks.give_up(task):
+                        self.logger.critical('Giving up slice %s after %s attempts' % (options, task.get('attempts')))
+                        self.tasks.fail(task, worker, error=repr(e))
+                    else:
+                        self.tasks.release(task, worker)
+                    continue
+                self.tasks.done(task, worker)
+        finally:
+            self.flush()
+            self.log_counts()
+
+
+    def get_newest_projects(self, incremental = False):
         '''
         Inserts / updates the 4000 newest 'live' projects in the mongodb collection
+
+        With incremental = True the scan stops at the first page that only has projects which are already
+        in the database, so frequent runs only fetch the few pages with new projects.
         '''
 
-        for project in kick.get_newest(options={'state' : 'live'}):
-            if project:
-                self.insert_to_database(project)
+        known = (lambda project: project['id'] in self.states) if incremental else None
+
+        try:
+            for project in self.kick.get_newest(options={'state' : 'live'}, known=known):
+                if project:
+                    self.insert_to_database(project)
+        finally:
+            self.flush()
+            self.log_counts()
 
 
     def update_live_projects(self):
         '''
-        Update all live projects presently in the database
+        Update the live projects in the database that are due
+
+        Every refreshed project gets a time it is due again ('next_refresh'), depending on how close its
+        deadline is and how fast it moved since the last refresh, see schedule.next_refresh. Projects that
+        were never scheduled come first, then the ones that are overdue the longest.
         '''
 
-        # find all projects in the database, that have an url field (they should all have)
-        live_projects = [c for c in self.collection.find({'state' : 'live'}, {'urls' : 1})]
+        # the due projects are read in chunks, so neither the projects nor a cursor are held for the whole run
+        now = datetime.datetime.utcnow()
+        query = self.__due_query(now)
+        fields = {'_id' : 0, 'id' : 1, 'urls.web.project' : 1, 'pledged' : 1, 'backers_count' : 1, 'updated' : 1}
 
-        total = len(live_projects)
-        self.logger.info('Found %s live projects' % total)
+        total = self.collection.find(query).count()
+        self.logger.info('Found %s due live projects' % total)
 
+        i = 0
+        try:
+            while True:
+                due = list(self.collection.find(query, fields).sort('next_refresh', pymongo.ASCENDING).limit(LIVE_CHUNK))
+                if not due:
+                    break
 
-        for i, project in enumerate(live_projects):
-            self.logger.info("scanning project %s of: %s"  %(i+1, total))
+                # push the chunk back a little before fetching it, so it isn't picked up again by the next query.
+                # Every project that is fetched gets its real next_refresh, the others are retried later
+                self.collection.update_many({'id' : {'$in' : [c['id'] for c in due]}},
+                                            {'$set' : {'next_refresh' : now + datetime.timedelta(seconds=schedule.MIN_INTERVAL)}})
 
-            url = project['urls']['web']['project']
+                live_projects = OrderedDict((c['urls']['web']['project'], c) for c in due)
+
+                # the project pages are downloaded concurrently, insert them as they come in
+                for url, project in self.kick.get_projects(iter(live_projects)):
+                    i += 1
+                    self.logger.debug("scanned project %s of: %s", i, total)
+
+                    if project:
+                        project['next_refresh'] = schedule.next_refresh(project, live_projects[url])
+                        self.insert_to_database(project)
+                    else:
+                        self.logger.critical('received empty project! url: %s' % url)
+
+                self.flush()
+        finally:
+            self.flush()
+            self.log_counts()
 
-            project = kick.get_project(url)
-            if project:
-                self.insert_to_database(project)
-            else:
-                self.logger.critical('received empty project! url: %s' % url)
-  
     def update_creator_data(self):
         '''
             Go through all projects in the database and
             scrape information about the creators if available.
+
+            Every creator is handled once, no matter how many projects they have. The data is cached in the
+            collection '<collection>_creators' for creator_ttl seconds, so creators that were scraped recently
+            aren't scraped again, and it is written to all projects of the creator with a single update.
         '''
-        for project in self.collection.find({'creator.Backed': {'$exists' : False}}):
-            self.logger.info('Updating creator info for project: %s', project['slug'])
-            url = project['creator']['urls']['web']['user']
-            data = kick.get_creator_data(url)
+
+        # the projects without creator data are read in chunks ordered by creator, every chunk continues after
+        # the last creator of the one before. Short queries instead of one cursor, which would time out
+        # between the slow page downloads
+        fields = {'_id' : 0, 'creator.id' : 1, 'creator.urls.web.user' : 1}
+        last = None
+
+        while True:
+            query = self.__creators_query(last)
+            projects = self.collection.find(query, fields).sort('creator.id', pymongo.ASCENDING).limit(CREATOR_CHUNK)
+
+            # one entry per creator, the projects of a creator come one after another
+            batch = []
+            for project in projects:
+                creator = project['creator']
+                if not batch or batch[-1]['_id'] != creator['id']:
+                    batch.append({'_id' : creator['id'],
+                                  'url' : creator.get('urls', {}).get('web', {}).get('user')})
+
+            if not batch:
+                break
+
+            self.__update_creators(batch)
+            last = batch[-1]['_id']
+
+    def __due_query(self, now):
+        # the live projects of this shard that are due for a refresh at now
+        query = {'state' : 'live', 'next_refresh' : {'$not' : {'$gt' : now}}}
+        query.update(self.__shard_filter('id'))
+        return query
+
+    def __creators_query(self, last):
+        # the projects of this shard without creator data, of the creators after last
+        query = {'creator.Backed' : {'$exists' : False},
+                 'creator.id' : {'$gt' : last} if last is not None else {'$exists' : True}}
+        query['creator.id'].update(self.__shard_filter('creator.id').get('creator.id', {}))
+        return query
+
+    def __shard_filter(self, field):
+        # the query part that selects the ids of this shard
+        if not self.shard:
+            return {}
+        index, count = self.shard
+        return {field : {'$mod' : [count, index]}}
+
+    def __creator_update(self, id_, data):
+        # sets the creator data in all projects of the creator
+        return UpdateMany({'creator.id' : id_}, {'$set' : {'creator.'+key : value for key,value in data.items()}})
+
+    def __update_creators(self, creators):
+        if not creators:
+            return
+
+        # creators that were scraped within creator_ttl don't have to be scraped again
+        fetched_after = datetime.datetime.utcnow() - datetime.timedelta(seconds=self.creator_ttl)
+        cached = self.creators.find({'_id' : {'$in' : [creator['_id'] for creator in creators]},
+                                     'fetched' : {'$gte' : fetched_after}})
+
+        operations = []
+        cached_ids = set()
+        for creator in cached:
+            self.logger.debug('Using cached creator info for creator: %s', creator['_id'])
+            operations.append(self.__creator_update(creator['_id'], creator['data']))
+            cached_ids.add(creator['_id'])
+
+        # the rest is scraped, every user page once
+        ids = {creator['url'] : creator['_id'] for creator in creators
+               if creator['_id'] not in cached_ids and creator['url']}
+
+        cache_operations = []
+        for url, data in self.kick.get_creators_data(ids.keys()):
             if data:
-                data = {'creator.'+key : value for key,value in data.items()}
-                self.collection.update({'_id' : project['_id']},
-                           {'$set' : data})
+                operations.append(self.__creator_update(ids[url], data))
+                cache_operations.append(UpdateOne({'_id' : ids[url]},
+                                                  {'$set' : {'data' : data, 'fetched' : datetime.datetime.utcnow()}},
+                                                  upsert=True))
             else:
-                self.logger.info('Failed to get creator info for project: %s', project['slug'])
+                self.logger.info('Failed to get creator info for creator: %s', ids[url])
+
+        if cache_operations:
+            with metrics.timer('pykick_mongo_write_seconds', collection='creators'):
+                self.creators.bulk_write(cache_operations, ordered=False)
+        if operations:
+            with metrics.timer('pykick_mongo_write_seconds', collection='projects'):
+                self.collection.bulk_write(operations, ordered=False)
 
 
     def insert_to_database(self, project):
         '''
-            Insert / update a project in the database
-        '''
+            Queue a project to be inserted / updated in the database.
 
-        # Change the id field to _id for mongodb
-        id_ = project['id']
+            Queued projects are written with Update.flush, as soon as there are batch_size of them
+            or flush_interval seconds have passed since the last write.
+        '''
 
         # Time when we updated this project (now)
         project['updated'] = datetime.datetime.utcnow()
@@ -197,49 +534,278 @@ class Update(object):
         # fix the floats in the project
         project = self.__fix_floats(project)
 
+        self.buffer.append(project)
+        metrics.inc('pykick_projects_total')
 
-        # Get the record form the collection, if it already exist
-        in_db = self.collection.find({'id' : id_})
+        if len(self.buffer) >= self.batch_size or time.time() - self.last_flush >= self.flush_interval:
+            self.flush()
 
-        # count is zero if the project is new
-        if in_db.count() == 0:
-            self.collection.insert(project)
-            self.logger.info('New project found: %s' % project['slug'])
-            old_state = project['state']
-        # otherwise, let's get the old state
-        else:
-            old_state = in_db.next()['state']
+    def flush(self):
+        '''
+            Write all queued projects to the database in a single bulk write
 
+            Only what changed is written: every project has a fingerprint of its fields, which is kept in the
+            state index, and the hash of every field in 'fingerprints'. A project with the same fingerprint as
+            before is skipped (apart from its next_refresh), otherwise only the changed fields and their hashes
+            are set.
+            A status sample is only taken if pledged, backers_count or state changed.
 
-        # if the state of the project changed from live to something else, set it to 1
-        project['state_changed']  = 1 if (old_state!=project['state'] and old_state == 'live') else 0
+            Projects whose update failed are not marked as written. If progress of get_all is pending, it is
+            dropped and the BulkWriteError is raised, so the pages of these projects are crawled again.
+        '''
+        self.last_flush = time.time()
+        if self.buffer:
+            projects, self.buffer = self.buffer, []
+            try:
+                self.__write(projects)
+            except pymongo.errors.BulkWriteError:
+                if not self.checkpoints.pending:
+                    # the projects that failed aren't in the state index, they are written again next time
+                    return
+                # some projects of these pages are missing, they must not count as done. A resumed sweep
+                # crawls them again
+                self.checkpoints.discard()
+                raise
+
+        # only now the pages these projects came from are really done
+        self.checkpoints.flush()
+
+    def ensure_indexes(self):
+        '''
+            Creates the indexes the queries of Update need, if they don't exist yet:
+                - id, unique: every write of a project and the lookups of stored fingerprints
+                - id, state, fingerprint: loading the state index reads only this index, not the projects
+                - state, next_refresh: the due live projects in update_live_projects
+                - creator.id: the creator data is written to all projects of a creator
+                - creator.Backed, creator.id: the projects without creator data in update_creator_data. A
+                  partial index can't select missing fields, but missing fields are indexed as null, so the
+                  projects without creator data are one range of this index, in the order of creator.id
+                - updated: incremental exports
+            and those of the status buckets and the task queue. All of them are built in the background, a
+            foreground build would lock the database for the whole build on mongodb 3.4.
+        '''
+        try:
+            self.collection.create_index([('id', pymongo.ASCENDING)], unique=True, name='id_unique', background=True)
+        except pymongo.errors.OperationFailure as e:
+            # there are duplicates from before, at least the lookups are indexed
+            self.logger.critical('Could not create a unique index on id, duplicate projects? %s', e)
+            self.collection.create_index([('id', pymongo.ASCENDING)], background=True)
+
+        self.collection.create_index(STATES_INDEX, background=True)
+        self.collection.create_index([('state', pymongo.ASCENDING), ('next_refresh', pymongo.ASCENDING)], background=True)
+        self.collection.create_index([('creator.id', pymongo.ASCENDING)], background=True)
+        self.collection.create_index([('creator.Backed', pymongo.ASCENDING), ('creator.id', pymongo.ASCENDING)], background=True)
+        self.collection.create_index([('updated', pymongo.ASCENDING)], background=True)
+
+        self.tasks.ensure_indexes()
+        if self.series:
+            self.series.ensure_indexes()
+
+    def query_plans(self):
+        '''
+            Returns the winning plans of the queries of Update as a dictionary name -> list of plan stages,
+            e.g. {'due live projects' : ['LIMIT', 'FETCH', 'IXSCAN'], ...}. Needs a mongodb server.
+        '''
+        now = datetime.datetime.utcnow()
+        cursors = {'state index' : self.__states_cursor(),
+                   'project by id' : self.collection.find({'id' : 0}),
+                   'stored fingerprints' : self.collection.find({'id' : {'$in' : [0, 1]}}, {'fingerprints' : 1}),
+                   'due live projects' : self.collection.find(self.__due_query(now))
+                                         .sort('next_refresh', pymongo.ASCENDING).limit(LIVE_CHUNK),
+                   'projects without creator data' : self.collection.find(self.__creators_query(0))
+                                                     .sort('creator.id', pymongo.ASCENDING).limit(CREATOR_CHUNK),
+                   'projects of a creator' : self.collection.find({'creator.id' : 0}),
+                   'incremental export' : self.collection.find({'updated' : {'$gt' : now}}).sort('updated', pymongo.ASCENDING),
+                   'task claim' : self.tasks.collection.find({'$or' : [{'state' : 'pending'},
+                                                                       {'state' : 'claimed', 'lease_until' : {'$lt' : now}}]})
+                                  .sort('created', pymongo.ASCENDING).limit(1)}
+        if self.series:
+            cursors['status bucket'] = self.series.collection.find({'project' : 0, 'day' : now, 'n' : {'$lt' : 1}})
+
+        plans = {}
+        for name, cursor in cursors.items():
+            plans[name] = self.__stages(cursor.explain()['queryPlanner']['winningPlan'])
+        return plans
+
+    def __stages(self, plan):
+        # the stages of a plan from the top down, all branches of an $or one after the other
+        stages = [plan['stage']]
+        if 'inputStage' in plan:
+            stages.extend(self.__stages(plan['inputStage']))
+        for stage in plan.get('inputStages', []):
+            stages.extend(self.__stages(stage))
+        return stages
+
+    def check_query_plans(self):
+        '''
+            Logs the queries of Update that scan the whole collection instead of using an index, or that should
+            only read an index but fetch the documents, and returns their names, see Update.query_plans
+        '''
+        scans = sorted(name for name, stages in self.query_plans().items()
+                       if 'COLLSCAN' in stages or (name in COVERED_QUERIES and 'FETCH' in stages))
+        for name in scans:
+            self.logger.critical('Query "%s" scans the whole collection or reads documents it shouldn\'t' % name)
+        return scans
 
-        if old_state=='live':
-            # if the state is still alive, append the newest status to the status array in the record.
+    def log_counts(self):
+        '''
+            Logs how many projects were written and how many were skipped because they didn't change
+        '''
+        self.logger.info('Wrote %s projects, skipped %s unchanged projects, took %s status samples'
+                         % (self.counts['written'], self.counts['skipped'], self.counts['samples']))
 
-            # Make a record of the current status, this will be *appended* to the record in the db
-            # and used to track the amount $ pledged over time
-            status = {'goal' : project['goal'],
-                    'time' : project['updated'],
-                    'pledged' : project['pledged'],
-                    'usd_pledged' : project['usd_pledged'],
-                    'backers_count' : project['backers_count'],
-                    'state' : project['state']}
+    def __old_state(self, project):
+        # the old state comes from the state index, a new project counts as if it had its current state before
+        return self.states.get(project['id'], project['state'])
 
-            #  update the project / will insert it if not in the db yet
-            self.collection.update({'id' : id_},
-                              { '$push': { 'status': status}})
+    def __fingerprint(self, project, old_state):
+        # if the state of the project changed from live to something else, set it to 1
+        project['state_changed']  = 1 if (old_state!=project['state'] and old_state == 'live') else 0
 
-            # set the new projects data. This has to happen in two separate steps, old mongodb versions don't like it otherwise
-            self.collection.update({'id' : id_},
-                               {'$set' : project})
-            self.logger.info('Updated live project: %s' % project['slug'])
+        fields = fingerprint.field_fingerprints(project)
+        project['fingerprint'] = fingerprint.fingerprint(fields)
+        return fields
+
+    def __write(self, projects):
+
+        # a project can show up more than once in a batch, only its latest data is written. With one update
+        # per project the order of the updates doesn't matter and one failed update doesn't stop the others
+        latest = OrderedDict()
+        for project in projects:
+            latest.pop(project['id'], None)
+            latest[project['id']] = project
+        projects = latest.values()
+
+        # the field fingerprints of the changed projects that are in the database already, read at once
+        old_states = {}
+        fields = {}
+        changed_ids = []
+        for project in projects:
+            id_ = project['id']
+            old_states[id_] = self.__old_state(project)
+            fields[id_] = self.__fingerprint(project, old_states[id_])
+            if id_ in self.states and self.states.fingerprint(id_) != project['fingerprint']:
+                changed_ids.append(id_)
+        stored = {}
+        if changed_ids:
+            for doc in self.collection.find({'id' : {'$in' : changed_ids}}, {'_id' : 0, 'id' : 1, 'fingerprints' : 1}):
+                stored[doc['id']] = doc.get('fingerprints')
+
+        # the written projects and whether a status sample was pushed, by the position of their update
+        operations = []
+        written = {}
+        for project in projects:
+            id_ = project['id']
+            old_state = old_states[id_]
+
+            if id_ not in self.states:
+                self.logger.debug('New project found: %s', project['slug'])
+
+            if id_ in self.states and self.states.fingerprint(id_) == project['fingerprint']:
+                # nothing changed, only the time of the next refresh is new
+                self.counts['skipped'] += 1
+                metrics.inc('pykick_projects_skipped_total')
+                if 'next_refresh' in project:
+                    operations.append(UpdateOne({'id' : id_}, {'$set' : {'next_refresh' : project['next_refresh']}}))
+                self.logger.debug('Unchanged project: %s', project['slug'])
+                continue
+
+            # only the fields that changed are set, everything for a project that is new to the database
+            changed = fingerprint.changed_fields(fields[id_], stored.get(id_))
+            # and only their hashes, so a write is as small as the change
+            update = {'$set' : {field : project[field] for field in changed}}
+            update['$set'].update({'fingerprints.' + field : fields[id_][field] for field in changed})
+            update['$set'].update({'updated' : project['updated'], 'fingerprint' : project['fingerprint']})
+            if 'next_refresh' in project:
+                update['$set']['next_refresh'] = project['next_refresh']
+
+            moved = any(field in changed for field in fingerprint.SAMPLE_FIELDS)
+            pushed = False
+
+            if old_state=='live' and not moved:
+                # nothing a status sample would show, e.g. only the description changed
+                self.logger.debug('Updated live project: %s', project['slug'])
+            elif old_state=='live' and self.series:
+                # the status goes to its own collection, written below
+                self.logger.debug('Updated live project: %s', project['slug'])
+            elif old_state=='live':
+                # if the state is still alive, append the newest status to the status array in the record.
+
+                # Make a record of the current status, this will be *appended* to the record in the db
+                # and used to track the amount $ pledged over time
+                update['$push'] = {'status' : {'goal' : project['goal'],
+                                                'time' : project['updated'],
+                                                'pledged' : project['pledged'],
+                                                'usd_pledged' : project['usd_pledged'],
+                                                'backers_count' : project['backers_count'],
+                                                'state' : project['state']}}
+                pushed = True
+                self.logger.debug('Updated live project: %s', project['slug'])
+            else:
+                # if it is an old project, don't push a new status update. This shouldn't happen usually.
+                self.logger.debug('Updated finished project: %s', project['slug'])
+
+            sample = old_state=='live' and moved and self.series is not None
+            written[len(operations)] = (project, pushed, sample)
+            operations.append(UpdateOne({'id' : id_}, update, upsert=True))
+
+        if not operations:
+            return
+
+        error = None
+        failed = set()
+        try:
+            with metrics.timer('pykick_mongo_write_seconds', collection='projects'):
+                self.collection.bulk_write(operations, ordered=False)
+        except pymongo.errors.BulkWriteError as e:
+            self.logger.critical('Bulk write of %s projects failed: %s', len(operations), e.details['writeErrors'])
+            error = e
+            failed = set(write_error['index'] for write_error in e.details['writeErrors'])
+
+        # only the projects that are in the database count as written, the others are written again next time
+        samples = []
+        for index, (project, pushed, sample) in sorted(written.items()):
+            if index in failed:
+                continue
+            self.states.set(project['id'], project['state'], project['fingerprint'])
+            self.counts['written'] += 1
+            metrics.inc('pykick_projects_written_total')
+            if pushed:
+                self.counts['samples'] += 1
+                metrics.inc('pykick_status_samples_total')
+            if sample:
+                samples.append(project)
+
+        if samples:
+            try:
+                with metrics.timer('pykick_mongo_write_seconds', collection='status'):
+                    count = self.series.write(samples)
+                self.counts['samples'] += count
+                metrics.inc('pykick_status_samples_total', count)
+            except pymongo.errors.BulkWriteError as e:
+                self.logger.critical('Bulk write of %s status samples failed: %s', len(samples), e.details['writeErrors'])
 
-        else:
-            # if it is an old project, don't push a new status update. This shouldn't happen usually.
-            self.collection.update({'id' : id_},
-                                  {'$set' : project})
-            self.logger.info('Updated finished project: %s' % project['slug'])
+        if error:
+            raise error
 
+    def export_projects(self, directory = './export', format = 'csv', incremental = False):
+        '''
+            Exports the projects and their status history to part files in directory, see export.Exporter.
+            With incremental = True only what changed since the last export into directory is exported.
+        '''
+        # projects are written up to flush_interval seconds after their 'updated' time, with room to spare
+        exporter = export.Exporter(self.collection, directory, status_collection=self.series.collection if self.series else None,
+                                   format=format, lag=max(export.LAG, 10 * self.flush_interval))
+        return exporter.export(incremental=incremental)
 
+    def get_pledged_curve(self, id_):
+        '''
+            Returns the pledged amount of the project with the given id over time, as a list of (datetime, pledged)
+        '''
+        if self.series:
+            return self.series.pledged_curve(id_)
 
+        project = self.collection.find_one({'id' : id_}, {'_id' : 0, 'status.time' : 1, 'status.pledged' : 1})
+        if not project:
+            return []
+        return [(status['time'], status['pledged']) for status in project.get('status', [])]
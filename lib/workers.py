@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import multiprocessing
+import update
+import metrics
+
+logger = logging.getLogger("pykick.workers")
+
+
+def sub_shard(shard, workers, k):
+    '''
+        Splits the shard (index, count) of this machine between its workers, returns the shard of worker k.
+        E.g. shard (1, 2) with 3 workers gives (1, 6), (3, 6) and (5, 6): all ids modulo 2 are still 1.
+    '''
+    index, count = shard or (0, 1)
+    return (index + k * count, count * workers)
+
+
+def worker_metrics(metrics_args, k):
+    '''
+        The metrics options of worker k: every worker has its own metrics, on the next ports and in numbered files
+    '''
+    metrics_args = dict(metrics_args or {})
+    if metrics_args.get('port'):
+        metrics_args['port'] += k + 1
+    if metrics_args.get('path'):
+        metrics_args['path'] = '%s.%s' % (metrics_args['path'], k)
+    return metrics_args
+
+
+def _work(update_args, method, kwargs, ready, metrics_args):
+    # runs in the worker process, everything with connections is created here and not inherited
+    dump = metrics.start(**metrics_args)
+    try:
+        ready.wait()
+        kick_updater = update.Update(**update_args)
+        getattr(kick_updater, method)(**kwargs)
+    finally:
+        if dump:
+            dump.stop()
+
+
+def _start(update_args, method, kwargs, ready, metrics_args):
+    process = multiprocessing.Process(target=_work, args=(update_args, method, kwargs, ready, metrics_args))
+    process.start()
+    return process
+
+
+def _join(processes):
+    failed = 0
+    for process in processes:
+        process.join()
+        if process.exitcode:
+            failed += 1
+    if failed:
+        logger.critical('%s of %s workers failed' % (failed, len(processes)))
+    return 1 if failed else 0
+
+
+def sweep(update_args, workers = 1, shard = None, resume = False, metrics_args = None):
+    '''
+        A get_all sweep by several worker processes, which claim the slices from the task queue.
+
+        The process of shard 0 (or without a shard) resets the queue and runs the partitioner, the processes
+        of other shards - on other machines sharing the database - only work on the slices. So shard 0 has
+        to be started first.
+    '''
+    planner = shard is None or shard[0] == 0
+
+    # the workers wait until the queue is reset, or they would see the finished queue of the last sweep
+    ready = multiprocessing.Event()
+    if not planner:
+        ready.set()
+
+    processes = [_start(update_args, 'work_slices', {}, ready, worker_metrics(metrics_args, k)) for k in range(workers)]
+
+    if not planner:
+        return _join(processes)
+
+    # the probes of the planner are counted in the metrics of this process
+    dump = metrics.start(**(metrics_args or {}))
+    try:
+        kick_updater = update.Update(**update_args)
+        kick_updater.prepare_slices(resume=resume)
+        ready.set()
+        kick_updater.plan_slices()
+    except BaseException:
+        # without a closed queue the workers would wait forever
+        for process in processes:
+            process.terminate()
+        raise
+    finally:
+        if dump:
+            dump.stop()
+
+    return _join(processes)
+
+
+def sharded(update_args, method, workers = 1, shard = None, metrics_args = None):
+    '''
+        Runs the Update method (update_live_projects or update_creator_data) in worker processes,
+        every one with its own shard of the ids
+    '''
+    ready = multiprocessing.Event()
+    ready.set()
+
+    processes = [_start(dict(update_args, shard=sub_shard(shard, workers, k)), method, {}, ready,
+                        worker_metrics(metrics_args, k))
+                 for k in range(workers)]
+    return _join(processes)
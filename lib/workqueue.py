@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+
+import os
+import socket
+import datetime
+import pymongo
+from pymongo import ReturnDocument
+
+# seconds a claimed task belongs to its worker, after that another worker may take it over
+LEASE = 10 * 60
+
+# number of times a task is claimed before an error in it marks it as failed
+MAX_ATTEMPTS = 3
+
+# id of the document that says whether all tasks were put into the queue
+CLOSED_ID = '__closed__'
+
+
+class LeaseLost(Exception):
+    '''
+        Raised by a worker that finds out another worker took its task over
+    '''
+
+
+def worker_name():
+    '''
+        Returns a name for this process that is unique across machines
+    '''
+    return '%s:%s' % (socket.gethostname(), os.getpid())
+
+
+class WorkQueue(object):
+    '''
+        A queue of tasks in a mongodb collection, shared by worker processes on one or many machines.
+
+        Every task is one document:
+
+            {'_id' : key, 'payload' : {...}, 'state' : 'pending' | 'claimed' | 'done' | 'failed',
+             'worker' : name, 'lease_until' : datetime, 'attempts' : 1}
+
+        WorkQueue.claim hands out a task atomically with find_one_and_update, so no task is worked on twice.
+        A claimed task has a lease, which the worker extends while it works. If the worker dies, the task can be
+        claimed by another worker once the lease ran out. A task that failed max_attempts times is given up,
+        WorkQueue.fail marks it as failed. Once all tasks are in the queue it is closed, so the workers know
+        they can stop when there is nothing left.
+
+        Parameters:
+            - collection: the mongodb collection of the queue
+            - lease: seconds for which a claimed task belongs to its worker, default is 10 minutes
+            - max_attempts: number of claims of a task before an error gives it up, default is 3
+    '''
+    def __init__(self, collection, lease = LEASE, max_attempts = MAX_ATTEMPTS):
+        self.collection = collection
+        self.lease = lease
+        self.max_attempts = max_attempts
+
+    def __lease_until(self):
+        return datetime.datetime.utcnow() + datetime.timedelta(seconds=self.lease)
+
+    def ensure_indexes(self):
+        '''
+            Creates the index WorkQueue.claim finds the next task with
+        '''
+        self.collection.create_index([('state', pymongo.ASCENDING), ('created', pymongo.ASCENDING)], background=True)
+
+    def reset(self):
+        '''
+            Removes all tasks, the queue is open again
+        '''
+        self.collection.delete_many({})
+
+    def open(self):
+        '''
+            Opens the queue for new tasks, the tasks in it are kept. Failed tasks get another max_attempts tries
+        '''
+        self.collection.delete_one({'_id' : CLOSED_ID})
+        self.collection.update_many({'state' : 'failed'}, {'$set' : {'state' : 'pending', 'attempts' : 0},
+                                                           '$unset' : {'error' : ''}})
+
+    def close(self):
+        '''
+            Marks that all tasks are in the queue
+        '''
+        self.collection.update_one({'_id' : CLOSED_ID}, {'$set' : {'state' : 'closed'}}, upsert=True)
+
+    def put(self, key, payload):
+        '''
+            Adds a task, unless there is one with the same key already
+        '''
+        self.collection.update_one({'_id' : key},
+                                   {'$setOnInsert' : {'payload' : payload, 'state' : 'pending', 'attempts' : 0,
+                                                      'created' : datetime.datetime.utcnow()}},
+                                   upsert=True)
+
+    def claim(self, worker):
+        '''
+            Returns the oldest task that is pending or whose lease ran out, now claimed by worker,
+            or None if there is no such task
+        '''
+        now = datetime.datetime.utcnow()
+        return self.collection.find_one_and_update({'$or' : [{'state' : 'pending'},
+                                                             {'state' : 'claimed', 'lease_until' : {'$lt' : now}}]},
+                                                   {'$set' : {'state' : 'claimed', 'worker' : worker,
+                                                              'lease_until' : self.__lease_until()},
+                                                    '$inc' : {'attempts' : 1}},
+                                                   sort=[('created', pymongo.ASCENDING)],
+                                                   return_document=ReturnDocument.AFTER)
+
+    def extend(self, task, worker):
+        '''
+            Extends the lease of a claimed task. Returns False if the task was taken over by another worker
+        '''
+        result = self.collection.update_one({'_id' : task['_id'], 'worker' : worker, 'state' : 'claimed'},
+                                            {'$set' : {'lease_until' : self.__lease_until()}})
+        return result.matched_count > 0
+
+    def done(self, task, worker):
+        '''
+            Marks a claimed task as done
+        '''
+        self.collection.update_one({'_id' : task['_id'], 'worker' : worker},
+                                   {'$set' : {'state' : 'done', 'finished' : datetime.datetime.utcnow()}})
+
+    def release(self, task, worker):
+        '''
+            Gives a claimed task back, e.g. after an error, so another worker can take it right away
+        '''
+        self.collection.update_one({'_id' : task['_id'], 'worker' : worker, 'state' : 'claimed'},
+                                   {'$set' : {'state' : 'pending'}, '$unset' : {'worker' : '', 'lease_until' : ''}})
+
+    def give_up(self, task):
+        '''
+            True if the task was claimed max_attempts times already, an error in it should fail it
+        '''
+        return task.get('attempts', 0) >= self.max_attempts
+
+    def fail(self, task, worker, error = None):
+        '''
+            Marks a claimed task as failed, it isn't handed out again and doesn't keep the queue from finishing
+        '''
+        self.collection.update_one({'_id' : task['_id'], 'worker' : worker, 'state' : 'claimed'},
+                                   {'$set' : {'state' : 'failed', 'error' : error, 'finished' : datetime.datetime.utcnow()},
+                                    '$unset' : {'lease_until' : ''}})
+
+    def finished(self):
+        '''
+            True if the queue is closed and every task in it is done or failed
+        '''
+        if not self.collection.find_one({'_id' : CLOSED_ID}):
+            return False
+        return self.collection.find_one({'state' : {'$in' : ['pending', 'claimed']}}) is None
@@ -2,21 +2,46 @@ import sys
 from lib.pykick import Pykick
 from lib import update
 from lib import arguments
+from lib import workers
+from lib import metrics
 
 
 def main():
 	args = arguments.Args()	
 	args = vars(args.get_args())
-	kick_updater = update.Update(host=args['host'], db=args['db'], uri=args['uri'], port=args['port'])
+	# the rate limit is for the whole machine, every worker process gets its share
+	rate_limit = args['rate_limit'] / max(args['workers'], 1) if args['rate_limit'] else None
+	kick_args = dict(workers=args['page_workers'], concurrency=args['concurrency'], rate_limit=rate_limit,
+	                 streaming=args['streaming'], cache_dir=args['cache_dir'])
+	update_args = dict(host=args['host'], db=args['db'], uri=args['uri'], port=args['port'],
+	                   status_buckets=args['status_buckets'], kick_args=kick_args)
+	metrics_args = dict(port=args['metrics_port'], host=args['metrics_host'], path=args['metrics_file'])
+
+	# several processes, or one of several machines: every process gets its own Update
+	if args['func'] == 'get_all' and (args['workers'] > 1 or args['shard']):
+		return workers.sweep(update_args, workers=args['workers'], shard=args['shard'], resume=args['resume'],
+		                     metrics_args=metrics_args)
+	if args['func'] in ('update_records', 'update_creator') and args['workers'] > 1:
+		method = 'update_live_projects' if args['func'] == 'update_records' else 'update_creator_data'
+		return workers.sharded(update_args, method, workers=args['workers'], shard=args['shard'],
+		                       metrics_args=metrics_args)
+
+	dump = metrics.start(**metrics_args)
+	kick_updater = update.Update(shard=args['shard'], **update_args)
 	
 	funcs = {
-	'get_all' : kick_updater.get_all_projects,
-	'get_newest' : kick_updater.get_newest_projects,
+	'get_all' : lambda: kick_updater.get_all_projects(resume=args['resume']),
+	'get_newest' : lambda: kick_updater.get_newest_projects(incremental=args['incremental']),
 	'update_records' : kick_updater.update_live_projects,
-	'update_creator' : kick_updater.update_creator_data
+	'update_creator' : kick_updater.update_creator_data,
+	'export' : lambda: kick_updater.export_projects(directory=args['export_dir'], format=args['format'],
+	                                                incremental=args['incremental'])
  	}
- 	funcs[args['func']]()
-	pass 
+	try:
+		funcs[args['func']]()
+	finally:
+		if dump:
+			dump.stop()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+
+import os
+import time
+import shutil
+import logging
+import tempfile
+import unittest
+
+import requests
+from requests.structures import CaseInsensitiveDict
+
+from lib.cache import HTTPCache
+from lib.pykick import Pykick
+
+URL = 'https://www.kickstarter.com/projects/1/a'
+
+
+def response(status_code, content = '', **headers):
+    r = requests.models.Response()
+    r.status_code = status_code
+    r.headers = CaseInsensitiveDict(headers)
+    r._content = content
+    return r
+
+
+class RecordingSession(object):
+    '''
+        Answers with the given responses one after the other and keeps the headers of every request
+    '''
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.headers = []
+
+    def get(self, url, headers = None, **kwargs):
+        self.headers.append(headers or {})
+        return self.answers.pop(0)
+
+
+class HTTPCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def store(self, cache, url, content, age):
+        # stores a page that was last used age seconds ago
+        cache.store(url, response(200, content, ETag='"%s"' % url))
+        key = cache.get(url)['key']
+        used = time.time() - age
+        os.utime(os.path.join(self.directory, key + '.body'), (used, used))
+        return key
+
+    def test_store_and_get(self):
+        cache = HTTPCache(self.directory)
+        cache.store(URL, response(200, 'page', ETag='"1"', **{'Last-Modified' : 'Mon, 01 Jan 2018 00:00:00 GMT',
+                                                               'Set-Cookie' : 'secret'}))
+        entry = cache.get(URL)
+        self.assertEqual(entry['headers'], {'ETag' : '"1"', 'Last-Modified' : 'Mon, 01 Jan 2018 00:00:00 GMT'})
+        self.assertEqual(cache.validators(entry), {'If-None-Match' : '"1"',
+                                                   'If-Modified-Since' : 'Mon, 01 Jan 2018 00:00:00 GMT'})
+        self.assertEqual(cache.response(entry).content, 'page')
+        # project pages are always revalidated
+        self.assertFalse(cache.is_fresh(entry))
+
+        # a new cache on the same directory finds the page
+        self.assertEqual(HTTPCache(self.directory).get(URL)['headers']['ETag'], '"1"')
+
+    def test_nothing_to_revalidate_with(self):
+        cache = HTTPCache(self.directory)
+        cache.store(URL, response(200, 'page'))
+        self.assertIsNone(cache.get(URL))
+
+    def test_ttl(self):
+        cache = HTTPCache(self.directory)
+        url = 'https://www.kickstarter.com/profile/1'
+        cache.store(url, response(200, 'user'))
+        self.assertTrue(cache.is_fresh(cache.get(url)))
+
+    def test_least_recently_used_are_evicted(self):
+        cache = HTTPCache(self.directory, max_size=40)
+        self.store(cache, URL + '1', 'x' * 10, age=40)
+        self.store(cache, URL + '2', 'x' * 10, age=30)
+        self.store(cache, URL + '3', 'x' * 10, age=20)
+        self.store(cache, URL + '1', 'x' * 10, age=10)
+
+        # over max_size, brought down to at most 90% of it: 2 is the oldest
+        cache.store(URL + '4', response(200, 'x' * 15, ETag='"4"'))
+        self.assertEqual([url for url in (URL + '1', URL + '2', URL + '3', URL + '4') if cache.get(url)],
+                         [URL + '1', URL + '3', URL + '4'])
+        self.assertEqual(cache.size, 35)
+        self.assertEqual(len(os.listdir(self.directory)), 6)
+
+    def test_shared_directory(self):
+        # two processes with one directory: the pages of the other are found and count for max_size
+        first = HTTPCache(self.directory, max_size=40)
+        second = HTTPCache(self.directory, max_size=40, rescan_interval=0)
+        self.store(first, URL + '1', 'x' * 15, age=30)
+        self.store(first, URL + '2', 'x' * 15, age=20)
+        self.assertEqual(second.get(URL + '1')['url'], URL + '1')
+
+        self.store(second, URL + '3', 'x' * 15, age=10)
+        self.assertEqual(sorted(name for name in os.listdir(self.directory) if name.endswith('.body')),
+                         sorted(first.get(url)['key'] + '.body' for url in (URL + '1', URL + '3')))
+        # the page the second one deleted is gone for the first one as well
+        self.assertIsNone(first.get(URL + '2'))
+        self.assertEqual(first.size, 30)
+
+
+class RevalidationTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_not_modified(self):
+        session = RecordingSession([response(200, 'page', ETag='"1"'), response(304), response(200, 'new', ETag='"2"')])
+        kick = Pykick(loglevel=logging.CRITICAL + 10, logfile=None, cache_dir=self.directory, session=session)
+
+        self.assertEqual(kick._Pykick__handle_request(URL).content, 'page')
+        self.assertEqual(session.headers[0], {})
+
+        # the server says the page didn't change, the cached page is used
+        self.assertEqual(kick._Pykick__handle_request(URL).content, 'page')
+        self.assertEqual(session.headers[1], {'If-None-Match' : '"1"'})
+
+        # it did change, the new page is stored
+        self.assertEqual(kick._Pykick__handle_request(URL).content, 'new')
+        self.assertEqual(kick.cache.get(URL)['headers']['ETag'], '"2"')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import os
+import csv
+import gzip
+import shutil
+import datetime
+import tempfile
+import unittest
+
+import mongomock
+
+from lib.export import Exporter
+
+
+def ago(minutes):
+    return datetime.datetime.utcnow() - datetime.timedelta(minutes=minutes)
+
+
+class ExporterTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.collection = mongomock.MongoClient().db.projects
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def add(self, id_, updated, status = ()):
+        self.collection.insert_one({'id' : id_, 'state' : 'live', 'updated' : updated,
+                                    'status' : [{'time' : time, 'pledged' : 1.} for time in status]})
+
+    def exporter(self, lag = 3600):
+        return Exporter(self.collection, self.directory, lag=lag)
+
+    def rows(self, table):
+        # the ids in the rows of all part files of a table, in the order of the files
+        ids = []
+        directory = os.path.join(self.directory, table)
+        for name in sorted(os.listdir(directory)):
+            with gzip.open(os.path.join(directory, name), 'rb') as f:
+                ids.extend(int(row['id']) for row in csv.DictReader(f))
+        return ids
+
+    def test_full_export(self):
+        self.add(1, ago(120), status=[ago(130), ago(120)])
+        self.add(2, ago(90))
+        self.assertEqual(self.exporter().export(), (2, 2))
+        self.assertEqual(sorted(self.rows('projects')), [1, 2])
+        self.assertEqual(self.rows('status'), [1, 1])
+
+    def test_watermark_is_the_last_update(self):
+        # everything was written long before the export, the watermark is the latest 'updated'
+        self.add(1, ago(120))
+        updated = self.collection.find_one()['updated']
+        self.exporter().export(incremental=True)
+        self.assertEqual(self.exporter().last_export(), updated)
+
+        # nothing new, nothing exported and the watermark stays
+        self.assertEqual(self.exporter().export(incremental=True), (0, 0))
+        self.assertEqual(self.exporter().last_export(), updated)
+
+    def test_watermark_lags_behind_recent_updates(self):
+        self.add(1, ago(5), status=[ago(5)])
+        start = datetime.datetime.utcnow()
+        self.exporter().export(incremental=True)
+        watermark = self.exporter().last_export()
+        self.assertTrue(start - datetime.timedelta(minutes=60) <= watermark <= ago(60))
+
+        # a project queued before project 1 but written after the export is exported by the next one, and
+        # project 1 again, as it is within the lag
+        self.add(2, ago(6), status=[ago(6)])
+        self.assertEqual(self.exporter().export(incremental=True), (2, 2))
+        self.assertEqual(sorted(self.rows('projects')), [1, 1, 2])
+
+    def test_watermark_never_goes_back(self):
+        self.add(1, ago(120))
+        self.exporter().export(incremental=True)
+        first = self.exporter().last_export()
+
+        # with a longer lag the watermark would go back before the last one, it stays where it was
+        self.add(2, ago(5))
+        self.exporter(lag=10 * 3600).export(incremental=True)
+        self.assertEqual(self.exporter().last_export(), first)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+
+import json
+import unittest
+
+from lib.extract import JSONArrayStream, find_project_text, extract_project
+
+
+def chunked(text, size):
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+def stream(text, size, key = 'projects'):
+    parser = JSONArrayStream(key)
+    items = []
+    for chunk in chunked(text, size):
+        items.extend(parser.feed(chunk))
+    return items, parser.close()
+
+
+class JSONArrayStreamTest(unittest.TestCase):
+
+    def test_items_and_rest(self):
+        doc = {'projects' : [{'id' : 1, 'name' : 'a'}, {'id' : 2, 'tags' : [1, {'b' : []}]}], 'total_hits' : 2}
+        items, rest = stream(json.dumps(doc), 7)
+        self.assertEqual(items, doc['projects'])
+        self.assertEqual(rest, {'projects' : [], 'total_hits' : 2})
+
+    def test_every_split(self):
+        # quotes, brackets and escapes in strings, split at every possible position
+        doc = {'projects' : [{'name' : 'say "hi" [to] {all}', 'path' : 'C:\\dir\\', 'u' : u'\u00e9'}],
+               'total_hits' : 1}
+        text = json.dumps(doc)
+        for size in range(1, len(text) + 1):
+            items, rest = stream(text, size)
+            self.assertEqual(items, doc['projects'], 'chunk size %s' % size)
+            self.assertEqual(rest['total_hits'], 1)
+
+    def test_escape_at_end_of_chunk(self):
+        text = '{"projects" : [{"name" : "a\\"b"}], "total_hits" : 1}'
+        split = text.index('\\') + 1
+        parser = JSONArrayStream('projects')
+        items = parser.feed(text[:split]) + parser.feed(text[split:])
+        self.assertEqual(items, [{'name' : 'a"b'}])
+        self.assertEqual(parser.close(), {'projects' : [], 'total_hits' : 1})
+
+    def test_empty_array(self):
+        items, rest = stream('{"projects" : [], "total_hits" : 0}', 3)
+        self.assertEqual(items, [])
+        self.assertEqual(rest, {'projects' : [], 'total_hits' : 0})
+
+    def test_nested_key(self):
+        # only the array of the outer object counts, not one under the same key further down
+        doc = {'meta' : {'projects' : [{'id' : 0}]},
+               'projects' : [{'id' : 1, 'projects' : [{'id' : 2}]}],
+               'total_hits' : 1}
+        text = '{"meta" : %s, "projects" : %s, "total_hits" : 1}' % (json.dumps(doc['meta']), json.dumps(doc['projects']))
+        items, rest = stream(text, 5)
+        self.assertEqual(items, doc['projects'])
+        self.assertEqual(rest, dict(doc, projects=[]))
+
+    def test_key_as_value(self):
+        items, rest = stream('{"name" : "projects", "list" : [1, 2], "projects" : [{"id" : 1}]}', 4)
+        self.assertEqual(items, [{'id' : 1}])
+        self.assertEqual(rest, {'name' : 'projects', 'list' : [1, 2], 'projects' : []})
+
+
+class FindProjectTextTest(unittest.TestCase):
+
+    PAGE = ('<html><script>\nwindow.current_project = "{&quot;id&quot;:1,&quot;name&quot;:&quot;a \\\\&quot;b\\\\&quot;&quot;}";\n'
+            'window.other = "x";\n</script></html>')
+
+    def test_marker_split_across_chunks(self):
+        for size in range(1, len(self.PAGE) + 1):
+            self.assertEqual(find_project_text(chunked(self.PAGE, size)),
+                             '{&quot;id&quot;:1,&quot;name&quot;:&quot;a \\\\&quot;b\\\\&quot;&quot;}',
+                             'chunk size %s' % size)
+
+    def test_extract_project(self):
+        self.assertEqual(extract_project([self.PAGE]), {'id' : 1, 'name' : 'a "b"'})
+
+    def test_no_project(self):
+        self.assertIsNone(find_project_text(chunked('<html>window.current_project = </html>', 4)))
+        self.assertIsNone(extract_project(['<html></html>']))
+
+
+if __name__ == '__main__':
+    unittest.main()
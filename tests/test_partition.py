@@ -0,0 +1,106 @@
+# -*- coding: utf-8 -*-
+
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+
+from lib.crawler import Crawler
+from lib.partition import Partitioner, read_categories
+
+
+class FakeKick(object):
+    '''
+        Answers probes from a list of projects, a project is a dict with the values of the discover filters.
+        Probes whose options contain all items of one of the fail dicts return None.
+    '''
+    def __init__(self, projects, fail = ()):
+        self.projects = projects
+        self.fail = fail
+        self.crawler = Crawler(concurrency=4)
+        self.probes = []
+
+    def matches(self, project, options):
+        for key, value in options.items():
+            if key == 'category_id':
+                if int(value) not in (project['category_id'], project['parent_id']):
+                    return False
+            elif key not in ('sort', 'page', 'format') and str(project.get(key)) != value:
+                return False
+        return True
+
+    def probe(self, options):
+        self.probes.append(options)
+        if any(all(options.get(k) == v for k, v in fail.items()) for fail in self.fail):
+            return None
+        return {'total_hits' : sum(1 for project in self.projects if self.matches(project, options)), 'projects' : []}
+
+
+def projects(count, **fields):
+    # projects spread over the categories 1 (with the subcategories 2 and 3) and 10 and all goal buckets
+    categories = [(1, 1), (2, 1), (3, 1), (10, 10)]
+    result = []
+    for i in range(count):
+        category_id, parent_id = categories[i % len(categories)]
+        project = {'state' : 'live', 'category_id' : category_id, 'parent_id' : parent_id, 'goal' : i % 5,
+                   'raised' : i % 3, 'pledged' : i % 5, 'woe_id' : 2347563}
+        project.update(fields)
+        result.append(project)
+    return result
+
+
+class PartitionerTest(unittest.TestCase):
+
+    def setUp(self):
+        logging.getLogger('pykick.Partitioner').setLevel(logging.CRITICAL + 10)
+        self.directory = tempfile.mkdtemp()
+        self.categories = os.path.join(self.directory, 'categories.txt')
+        with open(self.categories, 'w') as f:
+            f.write('1, art\n2, art/painting\n3, art/sculpture\n10, games\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def slices(self, kick, limit):
+        partitioner = Partitioner(kick, categories_file=self.categories, limit=limit)
+        return list(partitioner.slices(states=['live']))
+
+    def covered(self, kick, slices):
+        # how often every project is in one of the slices
+        return [sum(1 for options, _ in slices if kick.matches(project, options)) for project in kick.projects]
+
+    def test_read_categories(self):
+        self.assertEqual(read_categories(self.categories), ([1, 10], {1 : [2, 3], 10 : []}))
+
+    def test_small_slice_is_not_split(self):
+        kick = FakeKick(projects(8))
+        slices = self.slices(kick, 10)
+        self.assertEqual([options for options, _ in slices], [{'state' : 'live', 'sort' : 'newest'}])
+        self.assertEqual(slices[0][1]['total_hits'], 8)
+
+    def test_every_project_once(self):
+        kick = FakeKick(projects(200))
+        slices = self.slices(kick, 20)
+        self.assertTrue(all(first['total_hits'] <= 20 for _, first in slices))
+        self.assertEqual(self.covered(kick, slices), [1] * 200)
+
+    def test_split_that_loses_projects_is_skipped(self):
+        # projects of the main category 1 without a subcategory are lost by the split into 2 and 3
+        kick = FakeKick(projects(40, category_id=1, parent_id=1))
+        slices = self.slices(kick, 20)
+        self.assertFalse(any(options.get('category_id') in ('2', '3') for options, _ in slices))
+        self.assertEqual(self.covered(kick, slices), [1] * 40)
+
+    def test_failed_probe_skips_the_split(self):
+        # the goal bucket 2 can't be probed: the split by goal isn't used, raised is used instead
+        kick = FakeKick(projects(60, category_id=10, parent_id=10), fail=[{'goal' : '2'}])
+        slices = self.slices(kick, 20)
+        self.assertFalse(any('goal' in options for options, _ in slices))
+        self.assertEqual(self.covered(kick, slices), [1] * 60)
+        # the failed probe was tried again
+        self.assertEqual(sum(1 for options in kick.probes if options.get('goal') == '2'), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import unittest
+
+import requests
+
+from lib import pykick
+from lib.pykick import Pykick
+
+
+class FakeResponse(object):
+
+    def __init__(self, status_code, headers = None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+class FakeSession(object):
+    '''
+        Answers with the given responses one after the other, exceptions are raised
+    '''
+    def __init__(self, answers):
+        self.answers = list(answers)
+        self.calls = 0
+
+    def get(self, url, **kwargs):
+        self.calls += 1
+        answer = self.answers.pop(0)
+        if isinstance(answer, Exception):
+            raise answer
+        return answer
+
+
+class RequestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.backoff = pykick.BACKOFF_BASE
+        pykick.BACKOFF_BASE = 0.
+
+    def tearDown(self):
+        pykick.BACKOFF_BASE = self.backoff
+
+    def kick(self, answers, **kwargs):
+        return Pykick(loglevel=logging.CRITICAL + 10, logfile=None, session=FakeSession(answers), **kwargs)
+
+    def test_broken_bodies_are_retried(self):
+        ok = FakeResponse(200)
+        kick = self.kick([requests.exceptions.ChunkedEncodingError('broken'),
+                          requests.exceptions.ContentDecodingError('bad gzip'), ok])
+        self.assertIs(kick._Pykick__request('http://example.com/'), ok)
+        self.assertEqual(kick.session.calls, 3)
+
+    def test_final_errors_are_not_retried(self):
+        kick = self.kick([requests.exceptions.InvalidURL('no host')])
+        self.assertIsNone(kick._Pykick__request('http://'))
+        self.assertEqual(kick.session.calls, 1)
+
+    def test_retried_responses_are_closed(self):
+        failed = FakeResponse(503)
+        ok = FakeResponse(200)
+        kick = self.kick([failed, ok])
+        self.assertIs(kick._Pykick__request('http://example.com/'), ok)
+        self.assertTrue(failed.closed)
+        self.assertFalse(ok.closed)
+
+    def test_last_response_is_returned(self):
+        kick = self.kick([FakeResponse(503), FakeResponse(502)], max_retries=2)
+        r = kick._Pykick__request('http://example.com/')
+        self.assertEqual(r.status_code, 502)
+        self.assertFalse(r.closed)
+
+
+if __name__ == '__main__':
+    unittest.main()
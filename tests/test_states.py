@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from lib import states
+from lib.states import StateIndex
+
+
+class StateIndexTest(unittest.TestCase):
+
+    def setUp(self):
+        self.merge_size = states.MERGE_SIZE
+        states.MERGE_SIZE = 3
+
+    def tearDown(self):
+        states.MERGE_SIZE = self.merge_size
+
+    def test_load_sorts(self):
+        index = StateIndex()
+        index.load([{'id' : 30, 'state' : 'live'}, {'id' : 10, 'state' : 'failed'}, {'id' : 20, 'state' : 'successful'}])
+        self.assertEqual(list(index.ids), [10, 20, 30])
+        self.assertEqual([index.get(id_) for id_ in (10, 20, 30)], ['failed', 'successful', 'live'])
+        self.assertEqual(index.get(15, 'unknown'), 'unknown')
+        self.assertNotIn(15, index)
+
+    def test_merge(self):
+        index = StateIndex()
+        index.load([{'id' : 10, 'state' : 'live'}, {'id' : 40, 'state' : 'live'}])
+
+        # new projects stay in the dict until there are MERGE_SIZE of them
+        index.set(30, 'live')
+        index.set(5, 'failed')
+        self.assertEqual(len(index.recent), 2)
+        self.assertEqual(index.get(5), 'failed')
+        self.assertEqual(len(index), 4)
+
+        index.set(50, 'live')
+        self.assertEqual(index.recent, {})
+        self.assertEqual(list(index.ids), [5, 10, 30, 40, 50])
+        self.assertEqual([index.get(id_) for id_ in index.ids], ['failed', 'live', 'live', 'live', 'live'])
+        self.assertEqual(len(index), 5)
+
+    def test_set_known(self):
+        index = StateIndex()
+        index.load([{'id' : 10, 'state' : 'live'}])
+        index.set(10, 'successful')
+        self.assertEqual(index.recent, {})
+        self.assertEqual(index.get(10), 'successful')
+
+    def test_unknown_state(self):
+        index = StateIndex()
+        index.set(1, 'on_hold')
+        self.assertEqual(index.get(1), 'on_hold')
+        self.assertIn('on_hold', index.states)
+        self.assertNotIn('on_hold', states.STATES)
+
+
+class FingerprintTest(unittest.TestCase):
+
+    def setUp(self):
+        self.merge_size = states.MERGE_SIZE
+        states.MERGE_SIZE = 2
+
+    def tearDown(self):
+        states.MERGE_SIZE = self.merge_size
+
+    def test_load(self):
+        index = StateIndex()
+        index.load([{'id' : 20, 'state' : 'live', 'fingerprint' : 0xffffffff}, {'id' : 10, 'state' : 'failed'}])
+        self.assertEqual(index.fingerprints.itemsize, 4)
+        self.assertEqual([index.fingerprint(id_) for id_ in (10, 20)], [0, 0xffffffff])
+        self.assertEqual(index.fingerprint(15), 0)
+
+    def test_set_and_merge(self):
+        index = StateIndex()
+        index.load([{'id' : 10, 'state' : 'live', 'fingerprint' : 1}])
+        index.set(10, 'live', 2)
+        index.set(5, 'live', 0xfffffffe)
+        self.assertEqual(index.fingerprint(5), 0xfffffffe)
+
+        index.set(30, 'live', 3)
+        self.assertEqual(index.recent, {})
+        self.assertEqual([index.fingerprint(id_) for id_ in index.ids], [0xfffffffe, 2, 3])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+
+import time
+import logging
+import datetime
+import unittest
+
+import mongomock
+import pymongo
+
+from lib import update
+
+
+# the dates of the projects, the same in every scrape
+NOW = time.time()
+
+
+def project(id_, state = 'live', pledged = 10., **fields):
+    now = NOW
+    project = {'id' : id_, 'slug' : 'project-%s' % id_, 'name' : 'Project %s' % id_, 'state' : state,
+               'goal' : 100., 'static_usd_rate' : 1., 'pledged' : pledged, 'usd_pledged' : pledged,
+               'backers_count' : 1, 'created_at' : now, 'launched_at' : now, 'deadline' : now + 3600,
+               'state_changed_at' : now}
+    project.update(fields)
+    return project
+
+
+class FakeKick(object):
+    '''
+        Hands out one page of projects per slice, the slices of the states in broken raise a ValueError
+    '''
+    def __init__(self, pages, broken = ()):
+        self.pages = pages
+        self.broken = broken
+        self.calls = []
+
+    def get_pages(self, options = {}, known = None, first_page = None):
+        self.calls.append(options['state'])
+        if options['state'] in self.broken:
+            raise ValueError('not json')
+        return iter([(1, list(self.pages[options['state']]))])
+
+
+def new_update(kick, **kwargs):
+    return update.Update(client=mongomock.MongoClient(), db='test', loglevel=logging.CRITICAL + 10, logfile=None,
+                         kick=kick, **kwargs)
+
+
+class WriteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.kick_updater = new_update(None)
+        self.collection = self.kick_updater.collection
+        self.updates = []
+
+        # keep the updates of every bulk write of the projects
+        bulk_write = self.collection.bulk_write
+        def record(operations, **kwargs):
+            self.updates.append([operation._doc for operation in operations])
+            return bulk_write(operations, **kwargs)
+        self.collection.bulk_write = record
+
+    def write(self, *projects):
+        for project in projects:
+            self.kick_updater.insert_to_database(project)
+        self.kick_updater.flush()
+
+    def test_only_changes_are_set(self):
+        self.write(project(1))
+        stored = self.collection.find_one({'id' : 1})
+        self.assertEqual(set(stored['fingerprints']), set(project(1)) | set(['state_changed']))
+
+        self.write(project(1, pledged=20.))
+        update = self.updates[-1][0]
+        self.assertEqual(sorted(update['$set']), ['fingerprint', 'fingerprints.pledged', 'fingerprints.usd_pledged',
+                                                  'pledged', 'updated', 'usd_pledged'])
+        self.assertEqual(update['$push']['status']['pledged'], 20.)
+
+        stored = self.collection.find_one({'id' : 1})
+        self.assertEqual(stored['pledged'], 20.)
+        self.assertEqual(stored['fingerprint'], self.kick_updater.states.fingerprint(1))
+        self.assertEqual(len(stored['fingerprints']), len(project(1)) + 1)
+        self.assertEqual(self.kick_updater.counts['written'], 2)
+
+    def test_unchanged_project_is_skipped(self):
+        self.write(project(1))
+        self.write(project(1, next_refresh=datetime.datetime(2030, 1, 1)))
+        self.assertEqual(self.updates[-1], [{'$set' : {'next_refresh' : datetime.datetime(2030, 1, 1)}}])
+        self.assertEqual(self.kick_updater.counts['skipped'], 1)
+
+        self.write(project(1))
+        self.assertEqual(len(self.updates), 2)
+        self.assertEqual(self.kick_updater.counts['skipped'], 2)
+
+    def test_latest_entry_per_project(self):
+        self.write(project(1, pledged=20.), project(2), project(1, pledged=30.))
+        self.assertEqual([update['$set']['id'] for update in self.updates[-1]], [2, 1])
+        self.assertEqual(self.collection.find_one({'id' : 1})['pledged'], 30.)
+
+    def test_failed_updates(self):
+        self.write(project(1), project(2))
+
+        def fail_second(operations, **kwargs):
+            self.assertFalse(kwargs['ordered'])
+            raise pymongo.errors.BulkWriteError({'writeErrors' : [{'index' : 1, 'code' : 10334, 'errmsg' : 'too large'}]})
+        self.collection.bulk_write = fail_second
+
+        # without pending checkpoints the error is only logged, the failed project isn't marked as written
+        before = self.kick_updater.states.fingerprint(2)
+        self.write(project(1, pledged=20.), project(2, pledged=20.))
+        self.assertEqual(self.kick_updater.states.fingerprint(2), before)
+        self.assertEqual(self.kick_updater.counts['written'], 3)
+
+        # pending progress of get_all is dropped, the pages aren't done
+        self.kick_updater.checkpoints.page_done({'state' : 'live'}, 3)
+        self.kick_updater.insert_to_database(project(2, pledged=30.))
+        self.assertRaises(pymongo.errors.BulkWriteError, self.kick_updater.flush)
+        self.assertEqual(self.kick_updater.checkpoints.pending, {})
+        self.assertIsNone(self.kick_updater.checkpoints.get({'state' : 'live'}))
+
+
+class WorkSlicesTest(unittest.TestCase):
+
+    def test_broken_slice(self):
+        # a slice that raises doesn't stop the worker, it is given up after max_attempts claims
+        kick = FakeKick({'live' : [project(1)], 'failed' : [project(3, state='failed')]}, broken=('successful',))
+        kick_updater = new_update(kick)
+        kick_updater.prepare_slices()
+        for state in ('live', 'successful', 'failed'):
+            options = {'state' : state, 'sort' : 'newest'}
+            kick_updater.tasks.put(kick_updater.checkpoints.key(options), options)
+        kick_updater.tasks.close()
+
+        kick_updater.work_slices(poll_interval=0)
+
+        self.assertTrue(kick_updater.tasks.finished())
+        self.assertEqual(kick.calls.count('successful'), kick_updater.tasks.max_attempts)
+        states = {task['payload']['state'] : task['state'] for task in kick_updater.tasks.collection.find({'payload' : {'$exists' : True}})}
+        self.assertEqual(states, {'live' : 'done', 'successful' : 'failed', 'failed' : 'done'})
+        self.assertEqual(sorted(p['id'] for p in kick_updater.collection.find()), [1, 3])
+
+        # a resumed sweep tries the failed slice again
+        kick_updater.prepare_slices(resume=True)
+        self.assertEqual(kick_updater.tasks.collection.find_one({'payload.state' : 'successful'})['state'], 'pending')
+
+
+if __name__ == '__main__':
+    unittest.main()
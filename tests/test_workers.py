@@ -0,0 +1,37 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+from lib.workers import sub_shard, worker_metrics
+
+
+class SubShardTest(unittest.TestCase):
+
+    def test_no_shard(self):
+        self.assertEqual([sub_shard(None, 3, k) for k in range(3)], [(0, 3), (1, 3), (2, 3)])
+
+    def test_shard(self):
+        self.assertEqual([sub_shard((1, 2), 3, k) for k in range(3)], [(1, 6), (3, 6), (5, 6)])
+
+    def test_partition(self):
+        # every id belongs to exactly one worker of exactly one machine
+        machines, workers = 3, 4
+        for id_ in range(100):
+            owners = [(m, k) for m in range(machines) for k in range(workers)
+                      for index, count in [sub_shard((m, machines), workers, k)] if id_ % count == index]
+            self.assertEqual(len(owners), 1)
+            self.assertEqual(owners[0][0], id_ % machines)
+
+
+class WorkerMetricsTest(unittest.TestCase):
+
+    def test_ports_and_files(self):
+        args = {'port' : 9100, 'host' : '127.0.0.1', 'path' : 'metrics.json'}
+        self.assertEqual(worker_metrics(args, 0), {'port' : 9101, 'host' : '127.0.0.1', 'path' : 'metrics.json.0'})
+        self.assertEqual(worker_metrics(args, 2)['port'], 9102 + 1)
+        self.assertEqual(args['port'], 9100)
+        self.assertEqual(worker_metrics(None, 1), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+
+import mongomock
+
+from lib.workqueue import WorkQueue
+
+
+class WorkQueueTest(unittest.TestCase):
+
+    def queue(self, **kwargs):
+        queue = WorkQueue(mongomock.MongoClient().db.tasks, **kwargs)
+        queue.ensure_indexes()
+        for key in ('a', 'b'):
+            queue.put(key, {'key' : key})
+        return queue
+
+    def test_claim_in_order(self):
+        queue = self.queue()
+        queue.put('a', {'key' : 'again'})
+        self.assertEqual(queue.claim('w1')['payload'], {'key' : 'a'})
+        self.assertEqual(queue.claim('w2')['payload'], {'key' : 'b'})
+        self.assertIsNone(queue.claim('w3'))
+
+    def test_finished(self):
+        queue = self.queue()
+        a, b = queue.claim('w1'), queue.claim('w1')
+        queue.done(a, 'w1')
+        queue.done(b, 'w1')
+        # not before the queue is closed, more tasks could come
+        self.assertFalse(queue.finished())
+        queue.close()
+        self.assertTrue(queue.finished())
+
+    def test_lease_and_takeover(self):
+        queue = self.queue(lease=-1)
+        task = queue.claim('w1')
+
+        # the lease ran out, another worker takes the task over
+        taken = queue.claim('w2')
+        self.assertEqual(taken['_id'], task['_id'])
+        self.assertEqual(taken['attempts'], 2)
+        self.assertFalse(queue.extend(task, 'w1'))
+        self.assertTrue(queue.extend(taken, 'w2'))
+
+        # the old worker can't finish or give back a task it lost
+        queue.done(task, 'w1')
+        queue.release(task, 'w1')
+        self.assertEqual(queue.collection.find_one({'_id' : task['_id']})['worker'], 'w2')
+
+    def test_lease_holds(self):
+        queue = self.queue()
+        task = queue.claim('w1')
+        self.assertTrue(queue.extend(task, 'w1'))
+        self.assertNotEqual(queue.claim('w2')['_id'], task['_id'])
+        self.assertIsNone(queue.claim('w2'))
+
+    def test_release(self):
+        queue = self.queue()
+        task = queue.claim('w1')
+        queue.release(task, 'w1')
+        self.assertEqual(queue.claim('w2')['_id'], task['_id'])
+
+    def test_fail(self):
+        queue = self.queue(max_attempts=2)
+        task = queue.claim('w1')
+        self.assertFalse(queue.give_up(task))
+        queue.release(task, 'w1')
+        task = queue.claim('w1')
+        self.assertTrue(queue.give_up(task))
+        queue.fail(task, 'w1', error='ValueError()')
+        queue.done(queue.claim('w1'), 'w1')
+        self.assertIsNone(queue.claim('w1'))
+
+        queue.close()
+        self.assertTrue(queue.finished())
+
+        # reopening the queue gives the failed task another chance
+        queue.open()
+        task = queue.claim('w1')
+        self.assertEqual((task['_id'], task['attempts']), ('a', 1))
+        self.assertNotIn('error', task)
+
+    def test_reset(self):
+        queue = self.queue()
+        queue.close()
+        queue.reset()
+        self.assertIsNone(queue.claim('w1'))
+        self.assertFalse(queue.finished())
+
+
+if __name__ == '__main__':
+    unittest.main()